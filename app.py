@@ -1,15 +1,55 @@
+import time
+IMPORT_STARTED = time.perf_counter()
 import os
+import re
 import json
-import io
-import random
 import uuid 
+import io
+import hashlib
+import mimetypes
+import tempfile
+import csv
+import shutil
+import zipfile
+import click
+import threading
+import logging
+import queue
+import sqlite3
+from collections import OrderedDict, Counter, defaultdict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from werkzeug.utils import secure_filename
 from werkzeug.security import generate_password_hash, check_password_hash
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file, abort, send_from_directory
+from functools import wraps
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file, abort, send_from_directory, session, g, has_request_context, before_render_template, template_rendered, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session as FlaskSession
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from sqlalchemy import func
+from sqlalchemy.exc import DataError, DBAPIError, IntegrityError
+from sqlalchemy.engine import Engine
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 # --- CONFIGURATION ---
 app = Flask(__name__)
@@ -23,15 +63,93 @@ if database_url and database_url.startswith("postgres://"):
 app.config['SQLALCHEMY_DATABASE_URI'] = database_url or 'sqlite:///babacarbazar_mega.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# Schema and admin bootstrap: `flask init-db` once per deployment, or lazily on a process's first request.
+app.config['BOOTSTRAP_ON_REQUEST'] = os.environ.get('BOOTSTRAP_ON_REQUEST', '1') != '0'
+app.config['ADMIN_EMAIL'] = os.environ.get('ADMIN_EMAIL', 'babaadmin@gmail.com')
+app.config['ADMIN_PASSWORD'] = os.environ.get('ADMIN_PASSWORD', '@namanadmin')
+
+# --- DATABASE ENGINE PROFILE ---
+# 'tuned' applies the settings below; 'default' leaves SQLAlchemy's defaults, for comparison runs.
+app.config['DB_PROFILE'] = os.environ.get('DB_PROFILE', 'tuned')
+app.config['SQLITE_BUSY_TIMEOUT_MS'] = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+app.config['SQLITE_MMAP_SIZE'] = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+app.config['SQLITE_CACHE_KB'] = int(os.environ.get('SQLITE_CACHE_KB', 64 * 1024))
+app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', 5))
+app.config['DB_MAX_OVERFLOW'] = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+app.config['DB_POOL_RECYCLE'] = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+app.config['DB_STATEMENT_TIMEOUT_MS'] = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 5000))
+app.config['DB_PREPARE_THRESHOLD'] = int(os.environ.get('DB_PREPARE_THRESHOLD', 5))
+
+replica_url = os.environ.get('DATABASE_REPLICA_URL')
+if replica_url and replica_url.startswith("postgres://"):
+    replica_url = replica_url.replace("postgres://", "postgresql://", 1)
+
+def engine_options(url):
+    """create_engine() keyword arguments for url under the configured DB_PROFILE."""
+    if app.config['DB_PROFILE'] != 'tuned':
+        return {}
+    if url.startswith('sqlite'):
+        # The remaining SQLite settings are PRAGMAs, applied per connection in set_sqlite_pragmas().
+        return {'connect_args': {'timeout': app.config['SQLITE_BUSY_TIMEOUT_MS'] / 1000.0}}
+    options = {'pool_size': app.config['DB_POOL_SIZE'], 'max_overflow': app.config['DB_MAX_OVERFLOW'],
+               'pool_pre_ping': True, 'pool_recycle': app.config['DB_POOL_RECYCLE']}
+    if url.startswith('postgresql'):
+        connect_args = {'options': f"-c statement_timeout={app.config['DB_STATEMENT_TIMEOUT_MS']}"}
+        if url.startswith('postgresql+psycopg:'):
+            # psycopg 3 prepares a statement server-side once it has run this many times.
+            connect_args['prepare_threshold'] = app.config['DB_PREPARE_THRESHOLD']
+        options['connect_args'] = connect_args
+    return options
+
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+if replica_url:
+    app.config['SQLALCHEMY_BINDS'] = {'replica': dict(engine_options(replica_url), url=replica_url)}
+
 # --- PATH CONFIGURATION ---
 basedir = os.path.abspath(os.path.dirname(__file__))
 app.config['UPLOAD_FOLDER'] = os.path.join(basedir, 'static/uploads')
 
+app.config['IMAGE_CACHE_FOLDER'] = os.environ.get('IMAGE_CACHE_FOLDER', os.path.join(basedir, 'cache/images'))
+app.config['IMAGE_CACHE_MAX_BYTES'] = int(os.environ.get('IMAGE_CACHE_MAX_BYTES', 1024 * 1024 * 1024))
+app.config['BLOB_FOLDER'] = os.environ.get('BLOB_FOLDER', os.path.join(basedir, 'blobs'))
+app.config['IMAGE_STORAGE'] = os.environ.get('IMAGE_STORAGE', 'db')  # 'db' or 'fs'
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE') == '1'
+app.config['IMAGE_CHUNK_SIZE'] = 256 * 1024
+app.config['IMAGE_MAX_AGE'] = 365 * 24 * 3600
+app.config['IMAGE_WORKERS'] = int(os.environ.get('IMAGE_WORKERS', 2))
+app.config['MAX_IMAGE_BYTES'] = int(os.environ.get('MAX_IMAGE_BYTES', 15 * 1024 * 1024))
+
+app.config['PRICE_MODEL_PATH'] = os.environ.get('PRICE_MODEL_PATH', os.path.join(basedir, 'models/price_model.npz'))
+
+# --- CACHE CONFIGURATION ---
+app.config['PAGE_CACHE_SIZE'] = int(os.environ.get('PAGE_CACHE_SIZE', 128))
+app.config['PAGE_CACHE_TTL'] = int(os.environ.get('PAGE_CACHE_TTL', 300))
+app.config['CACHE_REDIS_URL'] = os.environ.get('CACHE_REDIS_URL')
+
+# --- WRITE QUEUE CONFIGURATION ---
+app.config['WRITE_BEHIND'] = os.environ.get('WRITE_BEHIND', '1') != '0'
+app.config['WRITE_QUEUE_PATH'] = os.environ.get('WRITE_QUEUE_PATH', os.path.join(basedir, 'instance/write_queue.db'))
+app.config['WRITE_BATCH_SIZE'] = int(os.environ.get('WRITE_BATCH_SIZE', 200))
+app.config['WRITE_FLUSH_INTERVAL'] = float(os.environ.get('WRITE_FLUSH_INTERVAL', 0.5))
+app.config['EVENT_STREAM_SECONDS'] = float(os.environ.get('EVENT_STREAM_SECONDS', 30))
+
+# --- INSTRUMENTATION CONFIGURATION ---
+app.config['SLOW_QUERY_MS'] = float(os.environ.get('SLOW_QUERY_MS', 100))
+app.config['N_PLUS_ONE_THRESHOLD'] = int(os.environ.get('N_PLUS_ONE_THRESHOLD', 10))
+app.config['SERVER_TIMING'] = os.environ.get('SERVER_TIMING', '1') == '1'
+
 if not os.path.exists(app.config['UPLOAD_FOLDER']):
     os.makedirs(app.config['UPLOAD_FOLDER'])
 
 # --- EXTENSIONS ---
-db = SQLAlchemy(app)
+class RoutingSession(FlaskSession):
+    """Sends queries from @read_replica routes to the replica bind. Flushes always go to the primary."""
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and has_request_context() and g.get('use_replica'):
+            return db.engines['replica']
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 
@@ -57,9 +175,47 @@ class Car(db.Model):
     km_driven = db.Column(db.Integer)
     description = db.Column(db.Text)
     images = db.Column(db.Text, default='["default.jpg"]') 
+    cover_image = db.Column(db.String(255), default='default.jpg')
     status = db.Column(db.String(20), default='Available')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     reviews = db.relationship('Review', backref='car', lazy=True)
+    photos = db.relationship('CarImage', order_by='CarImage.position', cascade='all, delete-orphan', lazy=True)
+    __table_args__ = (
+        db.Index('ix_car_created_id', 'created_at', 'id'),
+        db.Index('ix_car_status_created', 'status', 'created_at'),
+        db.Index('ix_car_category_status', 'category', 'status'),
+        db.Index('ix_car_brand', 'brand'),
+        db.Index('ix_car_fuel', 'fuel'),
+        db.Index('ix_car_price', 'price'),
+    )
+
+    @property
+    def img_list(self):
+        return [p.name for p in self.photos] or [self.cover_image or 'default.jpg']
+
+    def set_images(self, names):
+        names = names or ['default.jpg']
+        self.photos = [CarImage(name=name, position=i) for i, name in enumerate(names)]
+        self.cover_image = names[0]
+        self.images = json.dumps(names)
+
+class CarImage(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    car_id = db.Column(db.Integer, db.ForeignKey('car.id'), nullable=False)
+    name = db.Column(db.String(255))
+    position = db.Column(db.Integer, default=0)
+    __table_args__ = (
+        db.Index('ix_car_image_car_position', 'car_id', 'position'),
+    )
+
+class SimilarCar(db.Model):
+    car_id = db.Column(db.Integer, db.ForeignKey('car.id'), primary_key=True)
+    rank = db.Column(db.Integer, primary_key=True)
+    similar_id = db.Column(db.Integer, db.ForeignKey('car.id'), nullable=False)
+    distance = db.Column(db.Float)
+    __table_args__ = (
+        db.Index('ix_similar_car_similar_id', 'similar_id'),
+    )
 
 class Enquiry(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -70,12 +226,21 @@ class Enquiry(db.Model):
     date = db.Column(db.DateTime, default=datetime.utcnow)
     is_read = db.Column(db.Boolean, default=False)
     car = db.relationship('Car')
+    __table_args__ = (
+        db.Index('ix_enquiry_date_id', 'date', 'id'),
+        db.Index('ix_enquiry_is_read', 'is_read'),
+        db.Index('ix_enquiry_car_id', 'car_id'),
+    )
 
 class Wishlist(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     car_id = db.Column(db.Integer, db.ForeignKey('car.id'))
     car = db.relationship('Car')
+    __table_args__ = (
+        db.Index('ix_wishlist_user_car', 'user_id', 'car_id', unique=True),
+        db.Index('ix_wishlist_car_id', 'car_id'),
+    )
 
 class Review(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -84,6 +249,9 @@ class Review(db.Model):
     rating = db.Column(db.Integer)
     comment = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    __table_args__ = (
+        db.Index('ix_review_car_created', 'car_id', 'created_at'),
+    )
 
 class PromoCode(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -98,17 +266,63 @@ class Banner(db.Model):
     subtitle = db.Column(db.String(200))
     is_active = db.Column(db.Boolean, default=True)
 
+class ImportJob(db.Model):
+    id = db.Column(db.String(32), primary_key=True)
+    filename = db.Column(db.String(255))
+    status = db.Column(db.String(20), default='queued')
+    processed = db.Column(db.Integer, default=0)
+    inserted = db.Column(db.Integer, default=0)
+    errors = db.Column(db.Text, default='[]')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+# --- MODEL: SCHEMA VERSION ---
+class SchemaVersion(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, default=0)
+
 # --- MODEL: IMAGE STORAGE ---
 class ImagePool(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(255), unique=True)
-    data = db.Column(db.LargeBinary) 
+    data = db.deferred(db.Column(db.LargeBinary))
     mimetype = db.Column(db.String(50))
+    storage = db.Column(db.String(10), default='db')
+    etag = db.Column(db.String(64))
+    size = db.Column(db.Integer)
+    uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
+    __table_args__ = (
+        db.Index('ix_image_pool_etag', 'etag'),
+    )
 
 @login_manager.user_loader
 def load_user(user_id):
     return User.query.get(int(user_id))
 
+# --- HELPER: ENGINE TUNING ---
+@db.event.listens_for(Engine, 'connect')
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """WAL lets readers run alongside the single writer; NORMAL sync is safe under WAL."""
+    if not isinstance(dbapi_connection, sqlite3.Connection) or app.config['DB_PROFILE'] != 'tuned':
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute(f"PRAGMA busy_timeout={app.config['SQLITE_BUSY_TIMEOUT_MS']}")
+    cursor.execute(f"PRAGMA mmap_size={app.config['SQLITE_MMAP_SIZE']}")
+    cursor.execute(f"PRAGMA cache_size=-{app.config['SQLITE_CACHE_KB']}")
+    cursor.execute('PRAGMA temp_store=MEMORY')
+    cursor.close()
+
+def read_replica(view):
+    """Serve a read-only view from DATABASE_REPLICA_URL when one is configured."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if replica_url:
+            g.use_replica = True
+        return view(*args, **kwargs)
+    return wrapper
+
 # --- HELPER: SAFE INT ---
 def safe_int(value):
     try:
@@ -116,35 +330,1392 @@ def safe_int(value):
     except (ValueError, TypeError):
         return 0
 
+# --- HELPER: KEYSET PAGINATION ---
+# Pages are sought by (timestamp, id) rather than OFFSET so the cost of a page
+# does not depend on how deep into the listing it is.
+PER_PAGE = 24
+
+def encode_cursor(stamp, row_id):
+    return f"{stamp.strftime('%Y%m%d%H%M%S%f')}-{row_id}"
+
+def decode_cursor(cursor):
+    try:
+        stamp, row_id = cursor.split('-')
+        return datetime.strptime(stamp, '%Y%m%d%H%M%S%f'), int(row_id)
+    except (ValueError, AttributeError):
+        return None
+
+def keyset_page(query, time_col, id_col, cursor, per_page=PER_PAGE, key=None):
+    """Return (rows, next_cursor) for one newest-first page of query."""
+    after = decode_cursor(cursor) if cursor else None
+    if after:
+        stamp, row_id = after
+        query = query.filter(db.or_(time_col < stamp, db.and_(time_col == stamp, id_col < row_id)))
+    rows = query.order_by(time_col.desc(), id_col.desc()).limit(per_page + 1).all()
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        stamp, row_id = key(rows[-1]) if key else (getattr(rows[-1], time_col.key), rows[-1].id)
+        next_cursor = encode_cursor(stamp, row_id)
+    return rows, next_cursor
+
+# --- HELPER: RATINGS ---
+def rating_summary():
+    """Per-car review aggregates as a subquery, so listings can join ratings in one GROUP BY."""
+    return db.session.query(
+        Review.car_id,
+        func.avg(Review.rating).label('avg_rating'),
+        func.count(Review.id).label('review_count')
+    ).group_by(Review.car_id).subquery()
+
+# --- BLOB STORAGE ---
+# ImagePool rows always hold the metadata. The bytes live either in
+# ImagePool.data (storage='db', the original layout) or in a content-addressed
+# file under BLOB_FOLDER (storage='fs'). IMAGE_STORAGE picks where new uploads go.
+class FileSystemBlobStore:
+    """Content-addressed files at <root>/ab/cd/<sha256>; identical content is stored once."""
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def exists(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def put_stream(self, chunks):
+        """Write an iterable of byte chunks and return (sha256, size)."""
+        digest, size = hashlib.sha256(), 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.root)
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    size += len(chunk)
+                    out.write(chunk)
+            key = digest.hexdigest()
+            path = self.path(key)
+            if os.path.exists(path):
+                os.remove(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return key, size
+
+blob_files = FileSystemBlobStore(app.config['BLOB_FOLDER'])
+spill_files = FileSystemBlobStore(app.config['IMAGE_CACHE_FOLDER'])
+
+def store_blob(img, data):
+    """Attach image bytes to an ImagePool row using the configured IMAGE_STORAGE backend."""
+    store_blob_stream(img, [data])
+
+def store_blob_stream(img, chunks):
+    if app.config['IMAGE_STORAGE'] == 'fs':
+        img.etag, img.size = blob_files.put_stream(chunks)
+        img.data = None
+        img.storage = 'fs'
+    else:
+        digest, parts = hashlib.sha256(), []
+        for chunk in chunks:
+            digest.update(chunk)
+            parts.append(chunk)
+        img.data = b''.join(parts)
+        img.etag = digest.hexdigest()
+        img.size = len(img.data)
+        img.storage = 'db'
+
+def read_blob(img):
+    if img.storage == 'fs':
+        with open(blob_files.path(img.etag), 'rb') as f:
+            return f.read()
+    return img.data
+
 # --- HELPER: SAVE IMAGE TO DB ---
-def save_image_to_db(file, preserve_name=False):
-    if not file or file.filename == '':
+class ImageTooLarge(ValueError):
+    pass
+
+def read_upload(file, chunk_size=64 * 1024):
+    """Yield an upload's bytes in chunks, refusing anything over MAX_IMAGE_BYTES."""
+    limit, total = app.config['MAX_IMAGE_BYTES'], 0
+    while True:
+        chunk = file.stream.read(chunk_size)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > limit:
+            raise ImageTooLarge(f"{file.filename} is larger than {limit // (1024 * 1024)} MB")
+        yield chunk
+
+def shared_image_name(etags):
+    """Map each etag to an existing uuid-named pool image with that content. Site
+    assets and variants are overwritten or derived in place, so they are never shared."""
+    names = {}
+    for etag, name in db.session.query(ImagePool.etag, ImagePool.name).filter(
+            ImagePool.etag.in_(set(etags)), ~ImagePool.name.contains('@')):
+        if etag not in names and IMMUTABLE_NAME_RE.match(name):
+            names[etag] = name
+    return names
+
+class ImageBatch:
+    """Stages uploads in the current session so they commit in the same transaction as
+    the Car or Banner that uses them. Identical content is stored once and its existing
+    name reused."""
+    def __init__(self):
+        self.by_etag = {}
+        self.new_names = []
+
+    def add(self, file, preserve_name=False):
+        if not file or file.filename == '':
+            return None
+        mimetype = file.mimetype or 'image/jpeg'
+
+        if preserve_name:
+            # Site assets are referenced by a fixed name and overwritten in place.
+            unique_name = secure_filename(file.filename)
+            img = ImagePool.query.filter_by(name=unique_name).first()
+            if img is None:
+                img = ImagePool(name=unique_name)
+                db.session.add(img)
+            img.mimetype = mimetype
+            img.uploaded_at = datetime.utcnow()
+            store_blob_stream(img, read_upload(file))
+            self.new_names.append(unique_name)
+            return unique_name
+
+        ext = os.path.splitext(file.filename)[1]
+        img = ImagePool(name=f"{uuid.uuid4().hex}{ext}", mimetype=mimetype)
+        store_blob_stream(img, read_upload(file))
+        duplicate = self.by_etag.get(img.etag) or shared_image_name([img.etag]).get(img.etag)
+        if duplicate:
+            return duplicate
+        db.session.add(img)
+        self.by_etag[img.etag] = img.name
+        self.new_names.append(img.name)
+        return img.name
+
+# --- HELPER: IMAGE DELIVERY ---
+# uuid-named uploads are never overwritten, so they can be cached forever.
+# Names kept via preserve_name (site assets) are revalidated with their ETag.
+IMMUTABLE_NAME_RE = re.compile(r'^[0-9a-f]{32}(@[a-z]+)?\.[A-Za-z0-9]+$')
+
+def iter_image_chunks(image_id, size):
+    chunk_size = app.config['IMAGE_CHUNK_SIZE']
+    for offset in range(0, size or 0, chunk_size):
+        chunk = db.session.query(func.substr(ImagePool.data, offset + 1, chunk_size)).filter(ImagePool.id == image_id).scalar()
+        if not chunk:
+            break
+        yield bytes(chunk)
+
+def blob_length(image_id):
+    return db.session.query(func.length(ImagePool.data)).filter(ImagePool.id == image_id).scalar() or 0
+
+# The spill cache is bounded by IMAGE_CACHE_MAX_BYTES: hits refresh a file's mtime,
+# and after every tenth of the budget has been written the least recently used
+# files are swept until the cache is back under 90% of it.
+_spill_state = {'written': None, 'lock': threading.Lock()}
+
+def prune_spill_cache(limit=None):
+    """Delete the least recently used spilled files until the cache fits. Returns the number removed."""
+    limit = app.config['IMAGE_CACHE_MAX_BYTES'] if limit is None else limit
+    files = []
+    for dirpath, _, names in os.walk(spill_files.root):
+        for name in names:
+            path = os.path.join(dirpath, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((st.st_mtime, st.st_size, path))
+    total = sum(size for _, size, _ in files)
+    if total <= limit:
+        return 0
+    removed = 0
+    for _, size, path in sorted(files):
+        if total <= limit * 0.9:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed += 1
+    return removed
+
+def note_spill(size):
+    """Count bytes spilled and sweep in the background once enough have been written."""
+    with _spill_state['lock']:
+        written = _spill_state['written']
+        # The first spill in a process sweeps too: the cache may have outgrown the budget before a restart.
+        sweep = written is None or written + size >= app.config['IMAGE_CACHE_MAX_BYTES'] // 10
+        _spill_state['written'] = 0 if sweep else written + size
+    if sweep:
+        image_workers.submit(prune_spill_cache)
+
+def spill_image(img_entry):
+    """Copy a database-held blob to the local disk cache chunk by chunk and return its path."""
+    if img_entry.etag and spill_files.exists(img_entry.etag):
+        path = spill_files.path(img_entry.etag)
+        try:
+            os.utime(path)
+            return path
+        except FileNotFoundError:
+            pass  # swept between the check and the touch
+
+    size = img_entry.size if img_entry.size is not None else blob_length(img_entry.id)
+    etag, size = spill_files.put_stream(iter_image_chunks(img_entry.id, size))
+    note_spill(size)
+
+    # Rows written before ETags existed get theirs filled in on first hit.
+    if img_entry.etag != etag or img_entry.size != size:
+        img_entry.etag = etag
+        img_entry.size = size
+        db.session.commit()
+    return spill_files.path(etag)
+
+def image_path(img_entry):
+    """Local file to serve for a pooled image: the blob file itself, or a spilled copy."""
+    if img_entry.storage == 'fs':
+        return blob_files.path(img_entry.etag)
+    return spill_image(img_entry)
+
+@app.cli.command('prune-image-cache')
+@click.option('--max-bytes', type=int, default=None, help='Budget to prune to (default IMAGE_CACHE_MAX_BYTES).')
+def prune_image_cache_command(max_bytes):
+    """Evict least recently used files from the image spill cache."""
+    click.echo(f"Removed {prune_spill_cache(max_bytes)} cached files.")
+
+@app.cli.command('migrate-blobs')
+@click.option('--batch-size', default=50, help='Rows moved per transaction.')
+def migrate_blobs_command(batch_size):
+    """Stream ImagePool blobs out of the database into the filesystem blob store."""
+    last_id, moved = 0, 0
+    while True:
+        batch = db.session.query(ImagePool.id, ImagePool.size).filter(
+            ImagePool.id > last_id, db.or_(ImagePool.storage.is_(None), ImagePool.storage == 'db')
+        ).order_by(ImagePool.id).limit(batch_size).all()
+        if not batch:
+            break
+        last_id = batch[-1].id
+        for image_id, size in batch:
+            if size is None:
+                size = blob_length(image_id)
+            etag, size = blob_files.put_stream(iter_image_chunks(image_id, size))
+            ImagePool.query.filter_by(id=image_id).update(
+                {'etag': etag, 'size': size, 'storage': 'fs', 'data': None}, synchronize_session=False)
+        db.session.commit()
+        moved += len(batch)
+        click.echo(f"Moved {moved} blobs (up to id {last_id}).")
+    click.echo("Done. Set IMAGE_STORAGE=fs for new uploads and VACUUM the database to reclaim space.")
+
+# --- HELPER: IMAGE VARIANTS ---
+# Resized copies live in ImagePool next to the original as "<stem>@<size><ext>"
+# plus a "<stem>@<size>.webp" encoding, e.g. 3f2a...@thumb.webp.
+IMAGE_VARIANTS = {'thumb': (160, 107), 'card': (640, 427), 'hero': (1600, 900)}
+image_workers = ThreadPoolExecutor(max_workers=app.config['IMAGE_WORKERS'])
+
+def variant_names(name, size):
+    stem, ext = os.path.splitext(name)
+    return {'WEBP': f"{stem}@{size}.webp", 'ORIGINAL': f"{stem}@{size}{ext}"}
+
+def find_variant(name, size):
+    names = variant_names(name, size)
+    rows = {r.name: r for r in ImagePool.query.filter(ImagePool.name.in_(names.values())).all()}
+    if 'image/webp' in request.headers.get('Accept', '') and names['WEBP'] in rows:
+        return rows[names['WEBP']]
+    return rows.get(names['ORIGINAL'])
+
+def encode_variant(img, box, fmt):
+    resized = img.copy()
+    resized.thumbnail(box, Image.LANCZOS)
+    if fmt == 'JPEG' and resized.mode not in ('RGB', 'L'):
+        resized = resized.convert('RGB')
+    out = io.BytesIO()
+    resized.save(out, fmt, quality=82, optimize=True)
+    return out.getvalue()
+
+def build_variants(name):
+    """Generate every size variant of a pooled image. Returns the number of rows written."""
+    original = ImagePool.query.filter_by(name=name).first()
+    if Image is None or original is None:
+        return 0
+    try:
+        img = Image.open(io.BytesIO(read_blob(original)))
+        fmt = img.format if img.format in ('JPEG', 'PNG', 'WEBP') else 'JPEG'
+        img = ImageOps.exif_transpose(img)
+    except Exception:
+        return 0
+
+    encoded = {}
+    for size, box in IMAGE_VARIANTS.items():
+        names = variant_names(name, size)
+        encoded[names['ORIGINAL']] = (encode_variant(img, box, fmt), Image.MIME[fmt])
+        encoded[names['WEBP']] = (encode_variant(img, box, 'WEBP'), 'image/webp')
+
+    ImagePool.query.filter(ImagePool.name.in_(encoded.keys())).delete(synchronize_session=False)
+    for vname, (data, mimetype) in encoded.items():
+        variant = ImagePool(name=vname, mimetype=mimetype)
+        store_blob(variant, data)
+        db.session.add(variant)
+    db.session.commit()
+    return len(encoded)
+
+def run_variant_job(name):
+    with app.app_context():
+        try:
+            return build_variants(name)
+        except Exception:
+            db.session.rollback()
+            app.logger.exception("Variant generation failed for %s", name)
+            return 0
+
+def queue_variants(names):
+    """Hand freshly uploaded images to the background pool so the request is not blocked on encoding."""
+    if Image is None:
+        return
+    for name in names:
+        if name and name != 'default.jpg':
+            image_workers.submit(run_variant_job, name)
+
+@app.cli.command('build-variants')
+@click.option('--batch-size', default=100, help='Originals processed per batch.')
+@click.option('--force', is_flag=True, help='Rebuild variants that already exist.')
+def build_variants_command(batch_size, force):
+    """Backfill resized and WebP variants for images already in the pool."""
+    if Image is None:
+        raise click.ClickException("Pillow is not installed.")
+    last_id, built = 0, 0
+    while True:
+        batch = db.session.query(ImagePool.id, ImagePool.name).filter(
+            ImagePool.id > last_id, ~ImagePool.name.contains('@')
+        ).order_by(ImagePool.id).limit(batch_size).all()
+        if not batch:
+            break
+        last_id = batch[-1].id
+        todo = [row.name for row in batch]
+        if not force:
+            done = {n for (n,) in db.session.query(ImagePool.name).filter(
+                ImagePool.name.in_([variant_names(n, 'thumb')['WEBP'] for n in todo]))}
+            todo = [n for n in todo if variant_names(n, 'thumb')['WEBP'] not in done]
+        db.session.remove()
+        built += sum(1 for count in image_workers.map(run_variant_job, todo) if count)
+        click.echo(f"Processed up to id {last_id}, {built} images with variants built.")
+
+# --- HELPER: CACHING ---
+class LRUCache:
+    """Small thread-safe in-process LRU with an optional per-entry TTL in seconds."""
+    def __init__(self, maxsize=256, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            expires = time.monotonic() + self.ttl if self.ttl else None
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+class RedisCache:
+    """Shared cache for multi-worker deployments. clear() bumps a generation so stale keys just expire."""
+    def __init__(self, url, prefix='bcb:page', ttl=None):
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def _key(self, key):
+        generation = int(self.client.get(f'{self.prefix}:generation') or 0)
+        return f'{self.prefix}:{generation}:{key!r}'
+
+    def get(self, key):
+        value = self.client.get(self._key(key))
+        return value.decode('utf-8') if value is not None else None
+
+    def set(self, key, value):
+        self.client.set(self._key(key), value, ex=self.ttl)
+
+    def clear(self):
+        self.client.incr(f'{self.prefix}:generation')
+
+# --- PAGE CACHE ---
+# Anonymous renders of catalog pages are kept until an admin mutation calls
+# invalidate_catalog(). Logged-in users and pending flash messages bypass it,
+# since both change the rendered HTML.
+if app.config['CACHE_REDIS_URL'] and redis is not None:
+    page_cache = RedisCache(app.config['CACHE_REDIS_URL'], ttl=app.config['PAGE_CACHE_TTL'])
+else:
+    page_cache = LRUCache(maxsize=app.config['PAGE_CACHE_SIZE'], ttl=app.config['PAGE_CACHE_TTL'])
+
+def cached_page(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method != 'GET' or current_user.is_authenticated or '_flashes' in session:
+            return view(*args, **kwargs)
+        key = (request.endpoint, tuple(sorted(kwargs.items())), tuple(sorted(request.args.items(multi=True))))
+        html = page_cache.get(key)
+        if html is not None:
+            return html, 200, {'X-Cache': 'HIT'}
+        html = view(*args, **kwargs)
+        if isinstance(html, str):
+            page_cache.set(key, html)
+        return html, 200, {'X-Cache': 'MISS'}
+    return wrapper
+
+def invalidate_catalog():
+    """Called by admin routes after anything shown on cached pages changes."""
+    page_cache.clear()
+    facet_cache.clear()
+
+# --- SEARCH ENGINE ---
+# SQLite keeps a car_search FTS5 table mirrored from Car by mapper events;
+# PostgreSQL uses a GIN expression index over the same document, so it needs
+# no mirroring. Anything else falls back to ILIKE.
+SEARCH_DOCUMENT_SQL = ("coalesce(name, '') || ' ' || coalesce(brand, '') || ' ' || coalesce(category, '') || ' ' || "
+                       "coalesce(fuel, '') || ' ' || coalesce(description, '')")
+SEARCH_LIMIT = 8
+search_cache = LRUCache(maxsize=1024, ttl=30)
+_fts_available = None
+
+def fts_enabled(bind):
+    global _fts_available
+    if bind.dialect.name != 'sqlite':
+        return False
+    if _fts_available is None:
+        _fts_available = db.inspect(bind).has_table('car_search')
+    return _fts_available
+
+def search_backend():
+    if db.engine.dialect.name == 'postgresql':
+        return 'postgresql'
+    return 'fts5' if fts_enabled(db.engine) else 'like'
+
+def search_terms(query):
+    return re.findall(r'\w+', query.lower())[:8]
+
+def search_cars(query, limit=SEARCH_LIMIT):
+    """Ranked prefix search over name, brand, category, fuel and description."""
+    terms = search_terms(query)
+    if not terms:
+        return []
+    cache_key = (' '.join(terms), limit)
+    cached = search_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    backend = search_backend()
+    if backend == 'fts5':
+        rows = db.session.execute(db.text(
+            "SELECT car.id, car.name, car.price, car.cover_image FROM car_search "
+            "JOIN car ON car.id = car_search.rowid WHERE car_search MATCH :match "
+            "ORDER BY bm25(car_search, 10.0, 8.0, 3.0, 2.0, 1.0) LIMIT :limit"
+        ), {'match': ' '.join(f'"{t}"*' for t in terms), 'limit': limit}).all()
+    elif backend == 'postgresql':
+        rows = db.session.execute(db.text(
+            f"SELECT id, name, price, cover_image FROM car, to_tsquery('simple', :tsquery) AS q "
+            f"WHERE to_tsvector('simple', {SEARCH_DOCUMENT_SQL}) @@ q "
+            f"ORDER BY ts_rank(to_tsvector('simple', {SEARCH_DOCUMENT_SQL}), q) DESC, id DESC LIMIT :limit"
+        ), {'tsquery': ' & '.join(f'{t}:*' for t in terms), 'limit': limit}).all()
+    else:
+        q = Car.query.with_entities(Car.id, Car.name, Car.price, Car.cover_image)
+        for t in terms:
+            q = q.filter(Car.name.ilike(f'%{t}%') | Car.brand.ilike(f'%{t}%'))
+        rows = q.order_by(Car.id.desc()).limit(limit).all()
+
+    results = [{'id': row.id, 'name': row.name, 'price': row.price, 'image': row.cover_image or 'default.jpg'}
+               for row in rows]
+    search_cache.set(cache_key, results)
+    return results
+
+def index_car(connection, car):
+    if not fts_enabled(connection):
+        return
+    connection.execute(db.text("DELETE FROM car_search WHERE rowid = :id"), {'id': car.id})
+    connection.execute(db.text(
+        "INSERT INTO car_search (rowid, name, brand, category, fuel, description) "
+        "VALUES (:id, :name, :brand, :category, :fuel, :description)"
+    ), {'id': car.id, 'name': car.name, 'brand': car.brand, 'category': car.category,
+        'fuel': car.fuel, 'description': car.description})
+
+def reindex_cars(connection, ids):
+    """Refresh search rows for cars written outside the ORM unit of work, e.g. bulk inserts."""
+    search_cache.clear()
+    if not ids or not fts_enabled(connection):
+        return
+    ids_param = db.bindparam('ids', expanding=True)
+    connection.execute(db.text("DELETE FROM car_search WHERE rowid IN :ids").bindparams(ids_param), {'ids': list(ids)})
+    connection.execute(db.text(
+        "INSERT INTO car_search (rowid, name, brand, category, fuel, description) "
+        "SELECT id, name, brand, category, fuel, description FROM car WHERE id IN :ids"
+    ).bindparams(ids_param), {'ids': list(ids)})
+
+@db.event.listens_for(Car, 'after_insert')
+@db.event.listens_for(Car, 'after_update')
+def car_search_upsert(mapper, connection, car):
+    index_car(connection, car)
+    search_cache.clear()
+
+@db.event.listens_for(Car, 'after_delete')
+def car_search_delete(mapper, connection, car):
+    if fts_enabled(connection):
+        connection.execute(db.text("DELETE FROM car_search WHERE rowid = :id"), {'id': car.id})
+    search_cache.clear()
+
+# --- INSTRUMENTATION ---
+# Each request collects DB and template time in g.perf; the remainder is
+# handler time. Totals go out as a Server-Timing header and into per-process
+# Prometheus histograms served at /metrics.
+slow_query_log = logging.getLogger('babacarbazar.slow_query')
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class RequestMetrics:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.histograms = defaultdict(lambda: [0] * len(self.buckets))
+        self.sums = defaultdict(float)
+        self.counts = defaultdict(int)
+        self.statuses = defaultdict(int)
+        self.queries = defaultdict(int)
+
+    def observe(self, route, method, status, seconds, query_count):
+        key = (route, method)
+        with self._lock:
+            hist = self.histograms[key]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    hist[i] += 1
+            self.sums[key] += seconds
+            self.counts[key] += 1
+            self.statuses[(route, method, status)] += 1
+            self.queries[key] += query_count
+
+    def render(self):
+        lines = ['# TYPE http_request_duration_seconds histogram']
+        with self._lock:
+            for (route, method), hist in sorted(self.histograms.items()):
+                labels = f'route="{route}",method="{method}"'
+                for bound, count in zip(self.buckets, hist):
+                    lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {self.counts[(route, method)]}')
+                lines.append(f'http_request_duration_seconds_sum{{{labels}}} {self.sums[(route, method)]:.6f}')
+                lines.append(f'http_request_duration_seconds_count{{{labels}}} {self.counts[(route, method)]}')
+            lines.append('# TYPE http_requests_total counter')
+            for (route, method, status), count in sorted(self.statuses.items()):
+                lines.append(f'http_requests_total{{route="{route}",method="{method}",status="{status}"}} {count}')
+            lines.append('# TYPE db_queries_total counter')
+            for (route, method), count in sorted(self.queries.items()):
+                lines.append(f'db_queries_total{{route="{route}",method="{method}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+request_metrics = RequestMetrics()
+
+def current_perf():
+    return g.get('perf') if has_request_context() else None
+
+@db.event.listens_for(Engine, 'before_cursor_execute')
+def perf_query_start(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+@db.event.listens_for(Engine, 'after_cursor_execute')
+def perf_query_end(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    if elapsed * 1000 >= app.config['SLOW_QUERY_MS']:
+        slow_query_log.warning("Slow query (%.1f ms) on %s: %s", elapsed * 1000,
+                               request.path if has_request_context() else '-', statement)
+    perf = current_perf()
+    if perf is not None:
+        perf['db_time'] += elapsed
+        perf['db_count'] += 1
+        perf['statements'][statement] += 1
+        # Lazy loads fired from inside a template are DB time, not template time.
+        if perf['template_start']:
+            perf['template_time'] -= elapsed
+
+@db.event.listens_for(Engine, 'handle_error')
+def perf_query_failed(context):
+    # A statement that raises never reaches after_cursor_execute; drop its start
+    # time so the pooled connection doesn't carry it into later timings.
+    conn = context.connection
+    if conn is not None and context.statement is not None and conn.info.get('query_start'):
+        conn.info['query_start'].pop()
+
+@before_render_template.connect_via(app)
+def perf_template_start(sender, template, context, **extra):
+    perf = current_perf()
+    if perf is not None:
+        perf['template_start'].append(time.perf_counter())
+
+@template_rendered.connect_via(app)
+def perf_template_end(sender, template, context, **extra):
+    perf = current_perf()
+    if perf is not None and perf['template_start']:
+        started = perf['template_start'].pop()
+        if not perf['template_start']:
+            perf['template_time'] += time.perf_counter() - started
+
+@app.before_request
+def perf_start():
+    g.perf = {'start': time.perf_counter(), 'db_time': 0.0, 'db_count': 0, 'template_time': 0.0,
+              'template_start': [], 'statements': Counter()}
+
+@app.after_request
+def perf_finish(response):
+    perf = current_perf()
+    if perf is None:
+        return response
+    total = time.perf_counter() - perf['start']
+    handler = max(total - perf['db_time'] - perf['template_time'], 0.0)
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    request_metrics.observe(route, request.method, response.status_code, total, perf['db_count'])
+
+    statement, repeats = perf['statements'].most_common(1)[0] if perf['statements'] else ('', 0)
+    if repeats >= app.config['N_PLUS_ONE_THRESHOLD']:
+        app.logger.warning("Possible N+1 on %s: statement ran %d times: %s", route, repeats, statement)
+
+    if app.config['SERVER_TIMING']:
+        response.headers['Server-Timing'] = ', '.join([
+            f'db;dur={perf["db_time"] * 1000:.1f};desc="{perf["db_count"]} queries"',
+            f'tpl;dur={perf["template_time"] * 1000:.1f}',
+            f'app;dur={handler * 1000:.1f}',
+            f'total;dur={total * 1000:.1f}',
+        ])
+    return response
+
+@app.route('/metrics')
+def metrics():
+    startup = ''.join(f'# TYPE app_{name[:-3]}_seconds gauge\napp_{name[:-3]}_seconds {ms / 1000:.4f}\n'
+                      for name, ms in sorted(startup_timings.items()))
+    return request_metrics.render() + startup, 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
+# --- PRICE MODEL ---
+# Ridge regression on log(price) over age, log(km) and one-hot brand, fuel,
+# transmission and category. The artifact keeps X'WX and X'Wy alongside the
+# coefficients so retraining only has to fold in new or newly sold cars.
+# Training rows count age from the year the car was listed, when its price was
+# asked; predictions count it from today, so folding in later never shifts ages.
+PRICE_FIELDS = ('brand', 'fuel', 'transmission', 'category')
+PRICE_BASE_COLUMNS = ['intercept', 'age', 'age_sq', 'log_km']
+PRICE_RIDGE = 1.0
+SOLD_WEIGHT = 3.0  # a sale is a realised price, listings are asking prices
+PRICE_FLOOR = 50000
+PRICE_MODEL_VERSION = 2  # 1 counted training ages from the first run's year
+_price_model = {'mtime': None, 'model': None}
+_price_model_lock = threading.Lock()
+
+def price_features(model_columns, rows, year_now):
+    """Design matrix for a list of dicts with year, km and the PRICE_FIELDS. Age runs to
+    a row's listed_year when it has one, else to year_now."""
+    index = {name: i for i, name in enumerate(model_columns)}
+    X = np.zeros((len(rows), len(model_columns)))
+    as_of = np.array([safe_int(r.get('listed_year')) or year_now for r in rows], dtype=float)
+    age = np.clip(as_of - np.array([safe_int(r.get('year')) or year_now for r in rows], dtype=float), 0, 40)
+    km = np.clip(np.array([safe_int(r.get('km')) for r in rows], dtype=float), 0, None)
+    X[:, 0] = 1.0
+    X[:, 1] = age
+    X[:, 2] = age ** 2 / 10.0
+    X[:, 3] = np.log1p(km)
+    for i, r in enumerate(rows):
+        for field in PRICE_FIELDS:
+            col = index.get(f"{field}={str(r.get(field) or '').strip().lower()}")
+            if col is not None:
+                X[i, col] = 1.0
+    return X
+
+def solve_price_model(model):
+    penalty = np.eye(len(model['columns'])) * PRICE_RIDGE
+    penalty[0, 0] = 0.0
+    model['coef'] = np.linalg.solve(model['xtx'] + penalty, model['xty'])
+
+def fold_in(model, rows, weights):
+    """Add weighted training rows to the model's sufficient statistics, growing the vocabulary as needed."""
+    known = set(model['columns'])
+    for r in rows:
+        for field in PRICE_FIELDS:
+            name = f"{field}={str(r.get(field) or '').strip().lower()}"
+            if name not in known:
+                known.add(name)
+                model['columns'].append(name)
+    grow = len(model['columns']) - model['xty'].shape[0]
+    if grow:
+        model['xtx'] = np.pad(model['xtx'], ((0, grow), (0, grow)))
+        model['xty'] = np.pad(model['xty'], (0, grow))
+    X = price_features(model['columns'], rows, datetime.utcnow().year)
+    y = np.log(np.array([r['price'] for r in rows], dtype=float))
+    w = np.asarray(weights, dtype=float)
+    model['xtx'] += X.T @ (X * w[:, None])
+    model['xty'] += X.T @ (w * y)
+    model['rows'] += float(w.sum())
+
+def save_price_model(model, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp.npz'
+    np.savez_compressed(tmp_path, columns=np.array(model['columns']), xtx=model['xtx'], xty=model['xty'],
+                        coef=model['coef'], rows=model['rows'], version=PRICE_MODEL_VERSION,
+                        last_car_id=model['last_car_id'], sold_ids=np.array(sorted(model['sold_ids']), dtype=np.int64))
+    os.replace(tmp_path, path)
+
+def load_price_model(path):
+    with np.load(path, allow_pickle=False) as data:
+        return {'columns': [str(c) for c in data['columns']], 'xtx': data['xtx'], 'xty': data['xty'],
+                'coef': data['coef'], 'rows': float(data['rows']),
+                'version': int(data['version']) if 'version' in data.files else 1,
+                'last_car_id': int(data['last_car_id']), 'sold_ids': set(int(i) for i in data['sold_ids'])}
+
+def price_model():
+    """The trained model, loaded once per process and reloaded only when the artifact changes."""
+    path = app.config['PRICE_MODEL_PATH']
+    if np is None or not os.path.exists(path):
         return None
-    
-    file_data = file.read()
-    
-    if preserve_name:
-        unique_name = secure_filename(file.filename)
-        existing = ImagePool.query.filter_by(name=unique_name).first()
-        if existing:
-            existing.data = file_data
-            existing.mimetype = file.mimetype or 'image/jpeg'
+    mtime = os.path.getmtime(path)
+    if _price_model['mtime'] != mtime:
+        with _price_model_lock:
+            if _price_model['mtime'] != mtime:
+                _price_model['model'] = load_price_model(path)
+                _price_model['mtime'] = mtime
+    return _price_model['model']
+
+def predict_prices(rows):
+    """Estimated market value for each row; deterministic for the same inputs."""
+    if not rows:
+        return []
+    year_now = datetime.utcnow().year
+    model = price_model()
+    if model is None:
+        # Depreciation curve used before a model has been trained.
+        return [int(max(800000 * (0.90 ** max(year_now - (safe_int(r.get('year')) or year_now), 0))
+                        - safe_int(r.get('km')) * 1.5, PRICE_FLOOR)) for r in rows]
+    X = price_features(model['columns'], rows, year_now)
+    return [int(p) for p in np.maximum(np.exp(X @ model['coef']), PRICE_FLOOR)]
+
+def car_price_row(car):
+    return {'year': car.year, 'km': car.km_driven, 'brand': car.brand, 'fuel': car.fuel,
+            'transmission': car.transmission, 'category': car.category, 'price': car.price}
+
+def training_row(car):
+    """car_price_row with age counted to the year the car was listed at that price."""
+    return dict(car_price_row(car), listed_year=car.created_at.year if car.created_at else None)
+
+def price_badges(cars):
+    """Set car.fair_price and car.price_badge for a page of cars with one vectorised prediction."""
+    if price_model() is None:
+        return
+    for car, fair in zip(cars, predict_prices([car_price_row(c) for c in cars])):
+        car.fair_price = fair
+        if car.price and car.price <= fair * 0.9:
+            car.price_badge = 'Great Price'
+        elif car.price and car.price <= fair * 1.1:
+            car.price_badge = 'Fair Price'
+
+@app.cli.command('train-price-model')
+@click.option('--full', is_flag=True, help='Retrain from scratch instead of folding in new data.')
+def train_price_model_command(full):
+    """Fit the valuation model from the Car table, incrementally by default."""
+    if np is None:
+        raise click.ClickException("NumPy is not installed.")
+    path = app.config['PRICE_MODEL_PATH']
+    model = load_price_model(path) if os.path.exists(path) and not full else None
+    if model is not None and model['version'] != PRICE_MODEL_VERSION:
+        click.echo("Saved model uses an older feature layout; retraining from scratch.")
+        model = None
+    if model is None:
+        model = {'columns': list(PRICE_BASE_COLUMNS), 'xtx': np.zeros((4, 4)), 'xty': np.zeros(4), 'coef': np.zeros(4),
+                 'rows': 0.0, 'version': PRICE_MODEL_VERSION, 'last_car_id': 0, 'sold_ids': set()}
+
+    usable = db.and_(Car.price > 0, Car.year > 0)
+    added = 0
+    # New listings since the last run; ones already sold count at full sale weight.
+    last_id = model['last_car_id']
+    while True:
+        batch = Car.query.filter(usable, Car.id > last_id).order_by(Car.id).limit(1000).all()
+        if not batch:
+            break
+        last_id = batch[-1].id
+        fold_in(model, [training_row(c) for c in batch], [SOLD_WEIGHT if c.status == 'Sold' else 1.0 for c in batch])
+        model['sold_ids'].update(c.id for c in batch if c.status == 'Sold')
+        added += len(batch)
+    # Listings that were already in the model and have been sold since top up to sale weight.
+    sold = Car.query.filter(usable, Car.status == 'Sold', Car.id <= model['last_car_id']).all()
+    newly_sold = [c for c in sold if c.id not in model['sold_ids']]
+    if newly_sold:
+        fold_in(model, [training_row(c) for c in newly_sold], [SOLD_WEIGHT - 1.0] * len(newly_sold))
+        model['sold_ids'].update(c.id for c in newly_sold)
+    model['last_car_id'] = max(model['last_car_id'], last_id)
+
+    if model['rows'] == 0:
+        raise click.ClickException("No priced cars to train on.")
+    solve_price_model(model)
+    save_price_model(model, path)
+    click.echo(f"Price model saved to {path}: {added} new listings, {len(newly_sold)} newly sold, "
+               f"{len(model['columns'])} features, {model['rows']:.0f} weighted rows.")
+
+# --- SIMILAR CARS ---
+# Each car keeps its SIMILAR_K nearest available neighbours in SimilarCar, so the
+# detail page reads a few rows by primary key. Vectors are log price, year and
+# log km over fixed scales plus weighted one-hot category, brand, fuel and
+# transmission. Fixed scales (not catalog statistics) keep every other car's
+# vector unchanged by an edit, so re-ranking only the changed cars and the lists
+# they enter or leave gives the same result as `flask build-similar`. Admin edits
+# re-rank on the background pool after their own commit, so the index trails a
+# change by the length of one distance pass.
+SIMILAR_K = 8
+SIMILAR_SHOWN = 3
+SIMILAR_BLOCK_CELLS = 2_000_000  # distance cells per block (~16 MB of float64), so memory stays flat as the catalog grows
+SIMILAR_NUMERIC = (('price', 0.35), ('year', 3.0), ('km_driven', 0.8))  # a unit of distance: ~35% price, 3 years, ~2x km
+SIMILAR_CATEGORICAL = (('category', 1.5), ('brand', 1.0), ('fuel', 0.5), ('transmission', 0.5))
+
+def similarity_catalog(exclude=()):
+    """(ids, feature matrix, available mask) for every car, from one column-only query."""
+    query = db.session.query(Car.id, Car.price, Car.year, Car.km_driven, Car.brand, Car.fuel,
+                             Car.transmission, Car.category, Car.status)
+    if exclude:
+        query = query.filter(~Car.id.in_(list(exclude)))
+    rows = query.order_by(Car.id).all()
+    if not rows:
+        return np.zeros(0, dtype=np.int64), np.zeros((0, 0)), np.zeros(0, dtype=bool)
+
+    numeric = np.array([[max(getattr(r, field) or 0, 0) for field, _ in SIMILAR_NUMERIC] for r in rows], dtype=float)
+    numeric[:, 0] = np.log1p(numeric[:, 0])
+    numeric[:, 2] = np.log1p(numeric[:, 2])
+    parts = [numeric / np.array([scale for _, scale in SIMILAR_NUMERIC])]
+    for field, weight in SIMILAR_CATEGORICAL:
+        values = [(getattr(r, field) or '').strip().lower() for r in rows]
+        vocab = {v: i for i, v in enumerate(sorted(set(values)))}
+        onehot = np.zeros((len(rows), len(vocab)))
+        onehot[np.arange(len(rows)), [vocab[v] for v in values]] = weight
+        parts.append(onehot)
+    ids = np.array([r.id for r in rows], dtype=np.int64)
+    available = np.array([r.status == 'Available' for r in rows], dtype=bool)
+    return ids, np.hstack(parts), available
+
+def pairwise_distances(X, rows, cols, sq=None):
+    """Euclidean distances between rows and cols of X, built in place in one len(rows) x len(cols) array."""
+    if sq is None:
+        sq = (X ** 2).sum(axis=1)
+    d = X[rows] @ X[cols].T
+    d *= -2.0
+    d += sq[rows, None]
+    d += sq[None, cols]
+    np.clip(d, 0, None, out=d)
+    return np.sqrt(d, out=d)
+
+def similarity_blocks(positions, width):
+    """Split positions into blocks whose distance matrix against width columns fits SIMILAR_BLOCK_CELLS."""
+    size = max(1, SIMILAR_BLOCK_CELLS // max(1, width))
+    for start in range(0, len(positions), size):
+        yield np.asarray(positions[start:start + size])
+
+def nearest_cars(ids, X, available, sources):
+    """Yield {car_id: [(similar_id, distance), ...]} for the catalog positions in sources, a block at a time."""
+    candidates = np.flatnonzero(available)
+    sq = (X ** 2).sum(axis=1)
+    for block in similarity_blocks(sources, len(candidates)):
+        ranked = {int(ids[i]): [] for i in block}
+        if len(candidates):
+            d = pairwise_distances(X, block, candidates, sq)
+            # A car is never its own neighbour; candidates is sorted, so find each source's own column.
+            own = np.minimum(np.searchsorted(candidates, block), len(candidates) - 1)
+            hit = candidates[own] == block
+            d[np.flatnonzero(hit), own[hit]] = np.inf
+            k = min(SIMILAR_K, len(candidates))
+            top = np.argpartition(d, k - 1, axis=1)[:, :k] if k < len(candidates) else np.tile(np.arange(k), (len(block), 1))
+            for row, i in enumerate(block):
+                order = top[row][np.argsort(d[row, top[row]])]
+                ranked[int(ids[i])] = [(int(ids[candidates[j]]), float(d[row, j])) for j in order if np.isfinite(d[row, j])]
+        yield ranked
+
+def write_similar(ranked):
+    if not ranked:
+        return
+    SimilarCar.query.filter(SimilarCar.car_id.in_(list(ranked))).delete(synchronize_session=False)
+    rows = [{'car_id': car_id, 'rank': rank, 'similar_id': similar_id, 'distance': distance}
+            for car_id, neighbours in ranked.items() for rank, (similar_id, distance) in enumerate(neighbours)]
+    if rows:
+        db.session.bulk_insert_mappings(SimilarCar, rows)
+
+def forget_similar(car_id):
+    """Drop a car that is about to be deleted from the index, in the caller's transaction.
+    Returns the cars whose lists it was in, for update_similar(stale=...) after the commit."""
+    mentioned = {cid for (cid,) in db.session.query(SimilarCar.car_id)
+                 .filter(SimilarCar.similar_id == car_id).distinct()} - {car_id}
+    SimilarCar.query.filter(db.or_(SimilarCar.car_id == car_id, SimilarCar.similar_id == car_id)) \
+        .delete(synchronize_session=False)
+    return mentioned
+
+def update_similar(changed=(), stale=()):
+    """Re-rank neighbours after cars were added, edited or sold (changed) or after the
+    lists in stale lost a deleted car. Call it once the change has committed: the catalog
+    load and distance pass run before the first write, so its own transaction only holds
+    the write lock while the new lists are swapped in."""
+    if np is None:
+        return
+    changed = set(changed)
+    ids, X, available = similarity_catalog()
+    if not len(ids):
+        return
+    position = {int(car_id): i for i, car_id in enumerate(ids)}
+
+    # Lists that mention a changed car may now be wrong...
+    stale = {car_id for (car_id,) in db.session.query(SimilarCar.car_id)
+             .filter(SimilarCar.similar_id.in_(list(changed))).distinct()} | changed | set(stale)
+    # ...and so are lists a changed, available car now belongs in.
+    entering = [position[i] for i in changed if i in position and available[position[i]]]
+    if entering:
+        worst = dict(db.session.query(SimilarCar.car_id, func.max(SimilarCar.distance))
+                     .group_by(SimilarCar.car_id).having(func.count() >= SIMILAR_K))
+        worst = np.array([worst.get(int(car_id), np.inf) for car_id in ids])
+        sq = (X ** 2).sum(axis=1)
+        closest = np.full(len(ids), np.inf)
+        for block in similarity_blocks(entering, len(ids)):
+            d = pairwise_distances(X, block, np.arange(len(ids)), sq)
+            d[np.arange(len(block)), block] = np.inf
+            np.minimum(closest, d.min(axis=0), out=closest)
+        stale.update(int(car_id) for car_id in ids[closest < worst])
+
+    sources = sorted(position[i] for i in stale if i in position)
+    ranked = {}
+    for block in nearest_cars(ids, X, available, sources):
+        ranked.update(block)
+    write_similar(ranked)
+    db.session.commit()
+
+_similar_lock = threading.Lock()
+
+def run_similar_job(changed=(), stale=()):
+    # One re-rank at a time per process, so an older snapshot never overwrites a newer one.
+    with app.app_context(), _similar_lock:
+        try:
+            update_similar(changed, stale)
+            invalidate_catalog()
+        except Exception:
+            db.session.rollback()
+            app.logger.exception("Similar-cars update failed; `flask build-similar` repairs the index")
+
+def queue_similar(changed=(), stale=()):
+    """Re-rank on the background pool so admin requests don't wait on the distance pass."""
+    if np is not None and (changed or stale):
+        image_workers.submit(run_similar_job, list(changed), list(stale))
+
+def rebuild_similar():
+    """Recompute every car's neighbours, committing one block at a time. Returns the number of cars."""
+    if np is None:
+        return 0
+    SimilarCar.query.delete()
+    ids, X, available = similarity_catalog()
+    for ranked in nearest_cars(ids, X, available, np.arange(len(ids))):
+        write_similar(ranked)
+        db.session.commit()
+    db.session.commit()
+    return len(ids)
+
+@app.cli.command('build-similar')
+def build_similar_command():
+    """Rebuild the similar-cars index from scratch."""
+    if np is None:
+        raise click.ClickException("NumPy is not installed.")
+    click.echo(f"Ranked neighbours for {rebuild_similar()} cars.")
+
+# --- FACETS ---
+# Value facets filter on any of the selected values; range facets on a min/max
+# pair (min_price, max_year, ...). Counts for every facet come from one UNION ALL
+# of grouped queries, each ignoring its own facet's filter so the other options
+# stay visible, and are cached per filter set until invalidate_catalog().
+FACET_FIELDS = ('category', 'brand', 'fuel', 'transmission', 'status')
+FACET_RANGES = {
+    'price': ('price', [(None, 300000, 'Under ₹3L'), (300000, 600000, '₹3L – 6L'), (600000, 1000000, '₹6L – 10L'),
+                        (1000000, 2000000, '₹10L – 20L'), (2000000, None, '₹20L+')]),
+    'year': ('year', [(None, 2010, 'Before 2010'), (2010, 2015, '2010 – 2014'), (2015, 2020, '2015 – 2019'),
+                      (2020, None, '2020 onwards')]),
+    'km': ('km_driven', [(None, 20000, 'Under 20k km'), (20000, 50000, '20k – 50k km'),
+                         (50000, 100000, '50k – 100k km'), (100000, None, '100k+ km')]),
+}
+facet_cache = LRUCache(maxsize=512, ttl=app.config['PAGE_CACHE_TTL'])
+
+def facet_filters(args):
+    """The filter set in args, normalised so equal filters give equal cache keys."""
+    filters = {}
+    for field in FACET_FIELDS:
+        values = tuple(sorted({v for v in args.getlist(field) if v}))
+        if values:
+            filters[field] = values
+    for name in FACET_RANGES:
+        low, high = args.get(f'min_{name}', type=int), args.get(f'max_{name}', type=int)
+        if low is not None or high is not None:
+            filters[name] = (low, high)
+    return filters
+
+def facet_conditions(filters, skip=None):
+    conditions = []
+    for name, value in filters.items():
+        if name == skip:
+            continue
+        if name in FACET_RANGES:
+            column = getattr(Car, FACET_RANGES[name][0])
+            low, high = value
+            if low is not None: conditions.append(column >= low)
+            if high is not None: conditions.append(column <= high)
+        else:
+            conditions.append(getattr(Car, name).in_(value))
+    return conditions
+
+def filter_cars(query, args):
+    return query.filter(*facet_conditions(facet_filters(args)))
+
+def facet_counts(filters):
+    """{facet: [{'value'|'label', 'count', 'selected', ...}]} for the filter set, from one query."""
+    key = repr(sorted(filters.items()))
+    facets = facet_cache.get(key)
+    if facets is not None:
+        return facets
+
+    selects = []
+    for field in FACET_FIELDS:
+        column = getattr(Car, field)
+        selects.append(db.select(db.literal(field).label('facet'), column.label('value'), func.count().label('n'))
+                       .where(*facet_conditions(filters, skip=field)).group_by(column))
+    for name, (field, buckets) in FACET_RANGES.items():
+        column = getattr(Car, field)
+        bucket = db.case(*[(db.and_(*([column >= low] if low is not None else []),
+                                    *([column < high] if high is not None else [])), str(i))
+                           for i, (low, high, _) in enumerate(buckets)])
+        selects.append(db.select(db.literal(name).label('facet'), bucket.label('value'), func.count().label('n'))
+                       .where(column.isnot(None), *facet_conditions(filters, skip=name))
+                       .group_by(db.text('2')))  # by position: PostgreSQL won't match a parameterised CASE
+    counts = defaultdict(dict)
+    for facet, value, n in db.session.execute(db.union_all(*selects)):
+        if value not in (None, ''):
+            counts[facet][value] = n
+
+    facets = {}
+    for field in FACET_FIELDS:
+        selected = filters.get(field, ())
+        values = sorted(counts[field].items(), key=lambda item: (-item[1], item[0]))
+        values += [(v, 0) for v in selected if v not in counts[field]]
+        facets[field] = [{'value': v, 'count': n, 'selected': v in selected} for v, n in values]
+    for name, (_, buckets) in FACET_RANGES.items():
+        current = filters.get(name)
+        facets[name] = [{'label': label, 'min': low, 'max': high - 1 if high is not None else None,
+                         'count': counts[name].get(str(i), 0),
+                         'selected': current == (low, high - 1 if high is not None else None)}
+                        for i, (low, high, label) in enumerate(buckets)]
+    facet_cache.set(key, facets)
+    return facets
+
+def facet_url(args, name, low, high):
+    """The current inventory URL with one range facet set to low..high (or cleared)."""
+    params = args.to_dict(flat=False)
+    params.pop('after', None)
+    for bound, value in ((f'min_{name}', low), (f'max_{name}', high)):
+        params.pop(bound, None)
+        if value is not None:
+            params[bound] = value
+    return url_for('inventory', **params)
+
+# --- WRITE-BEHIND QUEUE ---
+# enquire() and add_review() append to a local SQLite WAL file instead of the main
+# database, so a burst of submissions never waits on the main writer lock. A worker
+# thread in each process claims batches, commits each batch to the main database in
+# one transaction and tells connected admins about new enquiries. Delivery is
+# at-least-once: a crash between that commit and the queue delete replays the batch.
+# Only writes the database rejects (bad payload, constraint violation) are dropped;
+# if the database itself fails (locked, unreachable) the claim is released and the
+# writes are retried.
+WRITE_CLAIM_TIMEOUT = 60
+WRITE_MODELS = {'enquiry': (Enquiry, 'date'), 'review': (Review, 'created_at')}
+
+class WriteQueue:
+    """Durable FIFO of pending writes, shared by every process on the host."""
+    def __init__(self, path):
+        self.path = path
+        self.wakeup = threading.Event()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._worker_pid = None
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS pending (id INTEGER PRIMARY KEY, kind TEXT NOT NULL, '
+                         'payload TEXT NOT NULL, created_at REAL NOT NULL, claimed_by TEXT, claimed_at REAL)')
+            self._local.conn = conn
+        return conn
+
+    def put(self, kind, payload):
+        self._conn().execute('INSERT INTO pending (kind, payload, created_at) VALUES (?, ?, ?)',
+                             (kind, json.dumps(payload), time.time()))
+        self.start()
+        self.wakeup.set()
+
+    def claim(self, limit):
+        """Take up to limit unclaimed (or abandoned) writes, oldest first."""
+        token, now = uuid.uuid4().hex, time.time()
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('UPDATE pending SET claimed_by = ?, claimed_at = ? WHERE id IN (SELECT id FROM pending '
+                         'WHERE claimed_by IS NULL OR claimed_at < ? ORDER BY id LIMIT ?)',
+                         (token, now, now - WRITE_CLAIM_TIMEOUT, limit))
+            rows = conn.execute('SELECT id, kind, payload FROM pending WHERE claimed_by = ? ORDER BY id', (token,)).fetchall()
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return [(row_id, kind, json.loads(payload)) for row_id, kind, payload in rows]
+
+    def done(self, ids):
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            self._conn().execute(f"DELETE FROM pending WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+
+    def release(self, ids):
+        """Hand claimed writes back to the queue so the next claim retries them."""
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            self._conn().execute(f"UPDATE pending SET claimed_by = NULL, claimed_at = NULL "
+                                 f"WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+
+    def depth(self):
+        return self._conn().execute('SELECT count(*) FROM pending').fetchone()[0]
+
+    def start(self):
+        """Start this process's worker thread if it isn't running (threads don't survive a fork)."""
+        if self._worker_pid == os.getpid() and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker_pid == os.getpid() and self._worker.is_alive():
+                return
+            self._worker = threading.Thread(target=run_write_worker, name='write-behind', daemon=True)
+            self._worker.start()
+            self._worker_pid = os.getpid()
+
+class EventBroker:
+    """Fans dashboard events out to the SSE streams connected to this process."""
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def publish(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait(event)
+            except queue.Full:
+                pass  # a stalled client misses events rather than blocking the worker
+
+    def listen(self, timeout):
+        """Yield events as they arrive, or None every `timeout` seconds of silence."""
+        q = queue.Queue(maxsize=100)
+        with self._lock:
+            self._subscribers.add(q)
+        try:
+            while True:
+                try:
+                    yield q.get(timeout=timeout)
+                except queue.Empty:
+                    yield None
+        finally:
+            with self._lock:
+                self._subscribers.discard(q)
+
+class RedisEventBroker:
+    """Same interface over Redis pub/sub, so every worker process sees every event."""
+    def __init__(self, url, channel='bcb:events'):
+        self.client = redis.Redis.from_url(url)
+        self.channel = channel
+
+    def publish(self, event):
+        self.client.publish(self.channel, json.dumps(event))
+
+    def listen(self, timeout):
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self.channel)
+        try:
+            while True:
+                message = pubsub.get_message(timeout=timeout)
+                yield json.loads(message['data']) if message else None
+        finally:
+            pubsub.close()
+
+write_queue = WriteQueue(app.config['WRITE_QUEUE_PATH'])
+if app.config['CACHE_REDIS_URL'] and redis is not None:
+    admin_events = RedisEventBroker(app.config['CACHE_REDIS_URL'])
+else:
+    admin_events = EventBroker()
+
+def build_write(kind, payload):
+    model, time_field = WRITE_MODELS[kind]
+    fields = dict(payload)
+    fields[time_field] = datetime.fromisoformat(fields.pop('submitted_at'))
+    return model(**fields)
+
+def apply_writes(items):
+    """Commit (id, kind, payload) writes in one transaction; returns (ids finished, enquiries written).
+    Payloads that can't be built are dropped. If the database rejects the batch, rows are
+    retried one by one and any it still rejects are dropped. Any other database error is
+    raised from the batch, or ends the one-by-one pass early, leaving the rest unfinished."""
+    finished, built = [], []
+    for row_id, kind, payload in items:
+        try:
+            built.append((row_id, kind, payload, build_write(kind, payload)))
+        except (KeyError, TypeError, ValueError):
+            app.logger.exception("Dropping malformed queued %s write: %r", kind, payload)
+            finished.append(row_id)
+    try:
+        db.session.add_all([obj for *_, obj in built])
+        db.session.commit()
+        return finished + [row[0] for row in built], [obj for *_, obj in built if isinstance(obj, Enquiry)]
+    except (IntegrityError, DataError):
+        db.session.rollback()
+    except DBAPIError:
+        db.session.rollback()
+        raise
+    written = []
+    for row_id, kind, payload, _ in built:
+        try:
+            obj = build_write(kind, payload)
+            db.session.add(obj)
             db.session.commit()
-            return unique_name
+            written.append(obj)
+        except (IntegrityError, DataError):
+            db.session.rollback()
+            app.logger.exception("Dropping queued %s write: %r", kind, payload)
+        except DBAPIError:
+            db.session.rollback()
+            app.logger.exception("Database unavailable; leaving queued writes for the next pass")
+            break
+        finished.append(row_id)
+    return finished, [obj for obj in written if isinstance(obj, Enquiry)]
+
+def publish_enquiries(enquiries):
+    if not enquiries:
+        return
+    names = dict(db.session.query(Car.id, Car.name).filter(Car.id.in_({e.car_id for e in enquiries if e.car_id})))
+    for enq in enquiries:
+        admin_events.publish({'type': 'enquiry', 'item': {
+            'id': enq.id, 'name': enq.name, 'phone': enq.phone, 'message': enq.message or '',
+            'car': names.get(enq.car_id, ''), 'is_read': False, 'date': enq.date.strftime('%d %b')}})
+
+def submit_write(kind, payload):
+    """Queue a write for the worker, or apply it inline when WRITE_BEHIND is off."""
+    payload = dict(payload, submitted_at=datetime.utcnow().isoformat())
+    if app.config['WRITE_BEHIND']:
+        write_queue.put(kind, payload)
     else:
-        ext = os.path.splitext(file.filename)[1]
-        unique_name = f"{uuid.uuid4().hex}{ext}"
-    
-    if not ImagePool.query.filter_by(name=unique_name).first():
-        new_img = ImagePool(name=unique_name, data=file_data, mimetype=file.mimetype or 'image/jpeg')
-        db.session.add(new_img)
+        publish_enquiries(apply_writes([(None, kind, payload)])[1])
+
+def drain_writes():
+    """Move queued writes into the main database until the queue is empty. Returns the count."""
+    total = 0
+    with app.app_context():
+        while True:
+            items = write_queue.claim(app.config['WRITE_BATCH_SIZE'])
+            if not items:
+                return total
+            claimed = [row_id for row_id, _, _ in items]
+            try:
+                finished, enquiries = apply_writes(items)
+            except Exception:
+                write_queue.release(claimed)
+                raise
+            write_queue.done(finished)
+            publish_enquiries(enquiries)
+            total += len(finished)
+            if len(finished) < len(claimed):
+                write_queue.release(sorted(set(claimed) - set(finished)))
+                return total
+
+def run_write_worker():
+    while True:
+        write_queue.wakeup.wait(app.config['WRITE_FLUSH_INTERVAL'])
+        write_queue.wakeup.clear()
+        try:
+            drain_writes()
+        except Exception:
+            app.logger.exception("Write-behind worker failed; retrying")
+            time.sleep(1)
+
+@app.before_request
+def start_write_worker():
+    # Picks up writes queued before a restart as soon as the process serves traffic.
+    if app.config['WRITE_BEHIND']:
+        write_queue.start()
+
+@app.cli.command('drain-writes')
+def drain_writes_command():
+    """Commit every queued enquiry and review now."""
+    click.echo(f"Committed {drain_writes()} queued writes.")
+
+# --- WISHLIST ---
+# Each user's saved car ids are cached as a frozenset so pages can mark hearts for a
+# whole grid without a query. The owning process drops the entry on every change;
+# other workers catch up within WISHLIST_CACHE_TTL.
+WISHLIST_CACHE_TTL = 60
+WISHLIST_LOOKUP_LIMIT = 200
+wishlist_cache = LRUCache(maxsize=4096, ttl=WISHLIST_CACHE_TTL)
+
+def wishlist_ids(user_id):
+    saved = wishlist_cache.get(user_id)
+    if saved is None:
+        saved = frozenset(car_id for (car_id,) in db.session.query(Wishlist.car_id).filter_by(user_id=user_id))
+        wishlist_cache.set(user_id, saved)
+    return saved
+
+def set_wishlisted(user_id, car_id, saved):
+    """Make car_id saved or not for user_id. Idempotent; returns the new state."""
+    if saved:
+        db.session.add(Wishlist(user_id=user_id, car_id=car_id))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()  # already saved (ix_wishlist_user_car is unique)
+    else:
+        Wishlist.query.filter_by(user_id=user_id, car_id=car_id).delete()
         db.session.commit()
-        
-    return unique_name
+    wishlist_cache.delete(user_id)
+    return saved
+
+@app.context_processor
+def inject_wishlist():
+    # A lambda so pages that never draw a heart don't touch the cache.
+    if current_user.is_authenticated:
+        return {'saved_cars': lambda: wishlist_ids(current_user.id)}
+    return {'saved_cars': frozenset}
 
 # --- PUBLIC ROUTES ---
 
 @app.route('/')
+@cached_page
+@read_replica
 def home():
     featured = Car.query.filter_by(status='Available').order_by(Car.created_at.desc()).limit(6).all()
     suvs = Car.query.filter_by(category='SUV', status='Available').limit(3).all()
@@ -152,59 +1723,94 @@ def home():
     banners = Banner.query.filter_by(is_active=True).all()
     if not banners: banners = []
     latest_promo = PromoCode.query.filter_by(is_active=True).order_by(PromoCode.id.desc()).first()
-    
-    for c_list in [featured, suvs, sedans]:
-        for car in c_list:
-            try: car.img_list = json.loads(car.images)
-            except: car.img_list = ['default.jpg']
             
     return render_template('index.html', page='home', cars=featured, suvs=suvs, sedans=sedans, banners=banners, latest_promo=latest_promo)
 
 @app.route('/static/uploads/<path:filename>')
 def custom_static(filename):
-    img_entry = ImagePool.query.filter_by(name=filename).first()
+    size = request.args.get('size')
+    img_entry = find_variant(filename, size) if size in IMAGE_VARIANTS else None
+    # Until the background pool has produced the variant, the original stands in
+    # and must not be cached as if it were the final resized file.
+    is_fallback = size in IMAGE_VARIANTS and img_entry is None
+    if img_entry is None:
+        img_entry = ImagePool.query.filter_by(name=filename).first()
     if img_entry:
-        return send_file(io.BytesIO(img_entry.data), mimetype=img_entry.mimetype)
+        path = image_path(img_entry)
+        immutable = bool(IMMUTABLE_NAME_RE.match(filename)) and not is_fallback
+        response = send_file(path, mimetype=img_entry.mimetype, conditional=True,
+                             etag=img_entry.etag, last_modified=img_entry.uploaded_at,
+                             max_age=app.config['IMAGE_MAX_AGE'] if immutable else 0)
+        response.cache_control.public = True
+        if immutable:
+            response.cache_control.immutable = True
+        else:
+            response.cache_control.no_cache = True
+        if size in IMAGE_VARIANTS:
+            response.vary.add('Accept')
+        return response
     try:
         return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
     except:
         return "Image not found", 404
 
+def inventory_page(args, per_page=PER_PAGE):
+    """One keyset page of filtered cars with ratings attached, plus the next cursor."""
+    ratings = rating_summary()
+    query = filter_cars(Car.query, args).outerjoin(ratings, ratings.c.car_id == Car.id) \
+        .add_columns(func.coalesce(ratings.c.avg_rating, 0))
+    rows, next_cursor = keyset_page(query, Car.created_at, Car.id, args.get('after'), per_page,
+                                    key=lambda row: (row[0].created_at, row[0].id))
+    cars = []
+    for car, avg_rating in rows:
+        car.avg_rating = float(avg_rating)
+        cars.append(car)
+    price_badges(cars)
+    return cars, next_cursor
+
 @app.route('/inventory')
+@read_replica
 def inventory():
-    query = Car.query
-    brand_filter = request.args.get('brand')
-    fuel_filter = request.args.get('fuel')
-    min_price = request.args.get('min_price', type=int)
-    max_price = request.args.get('max_price', type=int)
-
-    if brand_filter: query = query.filter(Car.brand == brand_filter)
-    if fuel_filter: query = query.filter(Car.fuel == fuel_filter)
-    if min_price: query = query.filter(Car.price >= min_price)
-    if max_price: query = query.filter(Car.price <= max_price)
-
-    all_cars = query.order_by(Car.created_at.desc()).all()
-    brands = [r.brand for r in db.session.query(Car.brand).distinct()]
-    
-    for car in all_cars:
-        try: car.img_list = json.loads(car.images)
-        except: car.img_list = ['default.jpg']
-        ratings = [r.rating for r in car.reviews]
-        car.avg_rating = sum(ratings)/len(ratings) if ratings else 0
+    all_cars, next_cursor = inventory_page(request.args)
+    filters = facet_filters(request.args)
+    facets = facet_counts(filters)
+    facets = dict(facets)
+    for name in FACET_RANGES:
+        facets[name] = [dict(bucket, url=facet_url(request.args, name, *((None, None) if bucket['selected'] else (bucket['min'], bucket['max']))))
+                        for bucket in facets[name]]
+    next_url = url_for('inventory', **dict(request.args.to_dict(flat=False), after=next_cursor)) if next_cursor else None
         
-    return render_template('index.html', page='inventory', cars=all_cars, brands=brands)
+    return render_template('index.html', page='inventory', cars=all_cars, facets=facets, filters=filters,
+                           facet_ranges=FACET_RANGES, next_url=next_url)
+
+@app.route('/api/inventory')
+def api_inventory():
+    per_page = min(max(request.args.get('limit', PER_PAGE, type=int), 1), 100)
+    cars, next_cursor = inventory_page(request.args, per_page)
+    body = {
+        'cars': [{'id': car.id, 'name': car.name, 'brand': car.brand, 'price': car.price, 'year': car.year,
+                  'fuel': car.fuel, 'km_driven': car.km_driven, 'status': car.status,
+                  'image': car.cover_image or 'default.jpg', 'avg_rating': round(car.avg_rating, 1)}
+                 for car in cars],
+        'next_cursor': next_cursor
+    }
+    if request.args.get('facets'):
+        body['facets'] = facet_counts(facet_filters(request.args))
+    return jsonify(body)
 
 @app.route('/car/<int:car_id>')
+@read_replica
 def car_detail(car_id):
-    car = Car.query.get_or_404(car_id)
-    try: car.img_list = json.loads(car.images)
-    except: car.img_list = ['default.jpg']
-    if not isinstance(car.img_list, list): car.img_list = [car.img_list]
-
-    similar = Car.query.filter(Car.category == car.category, Car.id != car.id).limit(3).all()
-    for s in similar:
-        try: s.img_list = json.loads(s.images)
-        except: s.img_list = ['default.jpg']
+    car = Car.query.options(db.selectinload(Car.photos)).filter_by(id=car_id).first_or_404()
+    similar = []
+    if np is not None:
+        similar = (Car.query.join(SimilarCar, SimilarCar.similar_id == Car.id)
+                   .filter(SimilarCar.car_id == car.id, Car.status == 'Available')
+                   .order_by(SimilarCar.rank).limit(SIMILAR_SHOWN).all())
+    if not similar:
+        # Index not built yet (or NumPy missing): fall back to the same category.
+        similar = Car.query.filter(Car.category == car.category, Car.id != car.id,
+                                   Car.status == 'Available').limit(SIMILAR_SHOWN).all()
         
     reviews = Review.query.filter_by(car_id=car.id).order_by(Review.created_at.desc()).all()
     avg_rating = 0
@@ -224,31 +1830,44 @@ def about():
 @app.route('/profile')
 @login_required
 def profile():
-    w_items = Wishlist.query.filter_by(user_id=current_user.id).all()
-    wishlist_cars = [item.car for item in w_items]
-    for car in wishlist_cars:
-        try: car.img_list = json.loads(car.images)
-        except: car.img_list = ['default.jpg']
+    w_items = Wishlist.query.options(db.joinedload(Wishlist.car)) \
+        .filter_by(user_id=current_user.id).order_by(Wishlist.id.desc()).all()
+    wishlist_cars = [item.car for item in w_items if item.car]
     return render_template('index.html', page='profile', wishlist=wishlist_cars)
 
 @app.route('/wishlist/toggle/<int:car_id>')
 @login_required
 def toggle_wishlist(car_id):
-    existing = Wishlist.query.filter_by(user_id=current_user.id, car_id=car_id).first()
-    if existing: db.session.delete(existing)
-    else: db.session.add(Wishlist(user_id=current_user.id, car_id=car_id))
-    db.session.commit()
+    # Decide from the table, not the per-process cache, which another worker may have outdated.
+    saved = db.session.query(Wishlist.id).filter_by(user_id=current_user.id, car_id=car_id).first() is not None
+    set_wishlisted(current_user.id, car_id, not saved)
     return redirect(request.referrer or url_for('home'))
 
+@app.route('/api/wishlist')
+@login_required
+def api_wishlist():
+    """Which of ?ids=1,2,3 the user has saved; all saved ids when ids is omitted."""
+    saved = wishlist_ids(current_user.id)
+    if 'ids' not in request.args:
+        return jsonify({'saved': sorted(saved)})
+    ids = [safe_int(i) for i in request.args['ids'].split(',')[:WISHLIST_LOOKUP_LIMIT]]
+    return jsonify({'saved': [i for i in ids if i in saved]})
+
+@app.route('/api/wishlist/<int:car_id>', methods=['PUT', 'DELETE'])
+@login_required
+def api_wishlist_item(car_id):
+    """PUT saves the car, DELETE removes it; repeating either is harmless. Both always
+    write, since the cached set may be stale and the unique index absorbs repeats."""
+    if request.method == 'PUT' and db.session.get(Car, car_id) is None: abort(404)
+    set_wishlisted(current_user.id, car_id, request.method == 'PUT')
+    return jsonify({'car_id': car_id, 'saved': request.method == 'PUT', 'count': len(wishlist_ids(current_user.id))})
+
 @app.route('/add-review', methods=['POST'])
 @login_required
 def add_review():
     car_id = request.form.get('car_id')
-    rating = safe_int(request.form.get('rating'))
-    comment = request.form.get('comment')
-    new_rev = Review(user_id=current_user.id, car_id=car_id, rating=rating, comment=comment)
-    db.session.add(new_rev)
-    db.session.commit()
+    submit_write('review', {'user_id': current_user.id, 'car_id': safe_int(car_id) or None,
+                            'rating': safe_int(request.form.get('rating')), 'comment': request.form.get('comment')})
     flash("Review Added!", "success")
     return redirect(url_for('car_detail', car_id=car_id))
 
@@ -295,57 +1914,65 @@ def logout():
     return redirect(url_for('home'))
 
 @app.route('/api/search')
+@read_replica
 def api_search():
-    query = request.args.get('q', '').lower()
-    cars = Car.query.filter((Car.name.ilike(f'%{query}%')) | (Car.brand.ilike(f'%{query}%'))).all()
-    results = []
-    for car in cars:
-        try: img = json.loads(car.images)[0]
-        except: img = 'default.jpg'
-        results.append({'id': car.id, 'name': car.name, 'price': car.price, 'image': img})
-    return jsonify(results)
+    query = request.args.get('q', '')
+    limit = min(max(request.args.get('limit', SEARCH_LIMIT, type=int), 1), 50)
+    return jsonify(search_cars(query, limit))
 
 @app.route('/api/predict_price', methods=['POST'])
 def predict_price():
-    data = request.json
-    try:
-        year = int(data.get('year'))
-        km = int(data.get('km'))
-        base = 800000 
-        age = 2026 - year
-        price = base * (0.90 ** age) - (km * 1.5)
-        price = price * random.uniform(0.95, 1.05)
-        return jsonify({'price': int(max(price, 50000))})
-    except:
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Send a JSON object'}), 400
+    if not safe_int(data.get('year')):
         return jsonify({'price': 0})
+    return jsonify({'price': predict_prices([data])[0]})
+
+@app.route('/api/predict_price/batch', methods=['POST'])
+def predict_price_batch():
+    """Price up to 500 cars at once, given either {"cars": [{...}]} or {"ids": [...]}."""
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict) or not all(isinstance(data.get(key) or [], list) for key in ('ids', 'cars')):
+        return jsonify({'error': 'Send {"cars": [...]} or {"ids": [...]}'}), 400
+    if 'ids' in data:
+        ids = [safe_int(i) for i in data.get('ids') or []][:500]
+        cars = {c.id: c for c in Car.query.filter(Car.id.in_(ids)).all()}
+        found = [i for i in ids if i in cars]
+        prices = predict_prices([car_price_row(cars[i]) for i in found])
+        return jsonify({'prices': [{'id': i, 'price': p, 'listed_price': cars[i].price} for i, p in zip(found, prices)]})
+    rows = [r for r in (data.get('cars') or [])[:500] if isinstance(r, dict)]
+    return jsonify({'prices': predict_prices(rows)})
 
 @app.route('/enquire', methods=['POST'])
 def enquire():
     car_id = request.form.get('car_id')
-    new_enq = Enquiry(name=request.form.get('name'), phone=request.form.get('phone'), message=request.form.get('message'), car_id=car_id)
-    db.session.add(new_enq)
-    db.session.commit()
+    submit_write('enquiry', {'name': request.form.get('name'), 'phone': request.form.get('phone'),
+                             'message': request.form.get('message'), 'car_id': safe_int(car_id) or None})
     flash("Message Sent Successfully!", "success")
     return redirect(url_for('car_detail', car_id=car_id))
 
+def daily_counts(column, days=7):
+    """Rows per calendar day over the last `days` days, oldest first, zero-filled."""
+    start = (datetime.utcnow() - timedelta(days=days - 1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    day = func.date(column)
+    counts = {str(d)[:10]: n for d, n in db.session.query(day, func.count()).filter(column >= start).group_by(day)}
+    return [counts.get((start + timedelta(days=i)).strftime('%Y-%m-%d'), 0) for i in range(days)]
+
 @app.route('/admin')
 @login_required
 def admin():
     if not current_user.is_admin: return redirect(url_for('home'))
     
-    stats = {
-        'total': Car.query.count(),
-        'value': db.session.query(db.func.sum(Car.price)).scalar() or 0,
-        'unread': Enquiry.query.filter_by(is_read=False).count(),
-        'sold': Car.query.filter_by(status='Sold').count()
-    }
+    unread = db.session.query(func.count(Enquiry.id)).filter(Enquiry.is_read == False).scalar_subquery()
+    total, value, sold, unread_count = db.session.query(
+        func.count(Car.id),
+        func.coalesce(func.sum(Car.price), 0),
+        func.count(db.case((Car.status == 'Sold', 1))),
+        unread
+    ).one()
+    stats = {'total': total, 'value': value, 'unread': unread_count, 'sold': sold}
     
-    cars = Car.query.order_by(Car.created_at.desc()).all()
-    for car in cars:
-        try: car.img_list = json.loads(car.images)
-        except: car.img_list = ['default.jpg']
-        
-    enquiries = Enquiry.query.order_by(Enquiry.date.desc()).all()
     promos = PromoCode.query.all()
     banners = Banner.query.all() 
     
@@ -353,23 +1980,72 @@ def admin():
     status_data = {s[0]: s[1] for s in status_counts}
     
     last_7_days = [(datetime.utcnow() - timedelta(days=i)).strftime('%d %b') for i in range(6, -1, -1)]
-    graph_data = [random.randint(1, 10) for _ in range(7)] 
+    graph_data = daily_counts(Enquiry.date)
+    listing_data = daily_counts(Car.created_at)
 
-    return render_template('index.html', page='admin', stats=stats, cars=cars, enquiries=enquiries, 
-                           promos=promos, banners=banners, status_data=status_data, graph_labels=last_7_days, graph_data=graph_data)
+    return render_template('index.html', page='admin', stats=stats, promos=promos, banners=banners,
+                           status_data=status_data, graph_labels=last_7_days, graph_data=graph_data, listing_data=listing_data)
+
+@app.route('/admin/api/cars')
+@login_required
+def admin_api_cars():
+    if not current_user.is_admin: abort(403)
+    cars, next_cursor = keyset_page(Car.query, Car.created_at, Car.id, request.args.get('after'))
+    return jsonify({
+        'items': [{'id': car.id, 'name': car.name, 'brand': car.brand, 'price': car.price,
+                   'status': car.status, 'image': car.cover_image or 'default.jpg'} for car in cars],
+        'next_cursor': next_cursor
+    })
+
+@app.route('/admin/api/enquiries')
+@login_required
+def admin_api_enquiries():
+    if not current_user.is_admin: abort(403)
+    query = Enquiry.query.options(db.joinedload(Enquiry.car))
+    enquiries, next_cursor = keyset_page(query, Enquiry.date, Enquiry.id, request.args.get('after'))
+    return jsonify({
+        'items': [{'id': enq.id, 'name': enq.name, 'phone': enq.phone, 'message': enq.message or '',
+                   'car': enq.car.name if enq.car else '', 'is_read': enq.is_read,
+                   'date': enq.date.strftime('%d %b') if enq.date else ''} for enq in enquiries],
+        'next_cursor': next_cursor
+    })
+
+@app.route('/admin/events')
+@login_required
+def admin_event_stream():
+    """Server-Sent Events feed of new enquiries for the dashboard. Each stream ends after
+    EVENT_STREAM_SECONDS so it can't hold a sync worker for good; the browser reconnects."""
+    if not current_user.is_admin: abort(403)
+    lifetime = app.config['EVENT_STREAM_SECONDS']
+    def stream():
+        deadline = time.monotonic() + lifetime
+        events = admin_events.listen(timeout=min(15, lifetime))
+        try:
+            yield 'retry: 1000\n\n'
+            for event in events:
+                if event is None:
+                    yield ': keep-alive\n\n'
+                else:
+                    yield f"event: {event['type']}\ndata: {json.dumps(event['item'])}\n\n"
+                if time.monotonic() >= deadline:
+                    break
+        finally:
+            events.close()
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/admin/add', methods=['POST'])
 @login_required
 def add_car():
     if not current_user.is_admin: return redirect(url_for('home'))
     files = request.files.getlist('images')
-    img_names = []
-    
-    for f in files:
-        fname = save_image_to_db(f)
-        if fname:
-            img_names.append(fname)
-    if not img_names: img_names = ['default.jpg']
+    images = ImageBatch()
+    try:
+        img_names = [name for name in (images.add(f) for f in files) if name]
+    except ImageTooLarge as e:
+        db.session.rollback()
+        flash(str(e), "danger")
+        return redirect(url_for('admin'))
     
     new_car = Car(
         name=request.form['name'],
@@ -380,11 +2056,14 @@ def add_car():
         fuel=request.form['fuel'],
         transmission=request.form['transmission'],
         km_driven=safe_int(request.form['km_driven']),
-        description=request.form['description'],
-        images=json.dumps(img_names)
+        description=request.form['description']
     )
+    new_car.set_images(img_names)
     db.session.add(new_car)
     db.session.commit()
+    queue_variants(images.new_names)
+    queue_similar(changed=[new_car.id])
+    invalidate_catalog()
     flash("Vehicle Added", "success")
     return redirect(url_for('admin'))
 
@@ -398,6 +2077,8 @@ def edit_car(car_id):
         car.price = safe_int(request.form['price'])
         car.status = request.form['status']
         db.session.commit()
+        queue_similar(changed=[car.id])
+        invalidate_catalog()
         flash("Vehicle Updated", "success")
     return redirect(url_for('admin'))
 
@@ -410,8 +2091,12 @@ def delete_car(car_id):
         Wishlist.query.filter_by(car_id=car.id).delete()
         Enquiry.query.filter_by(car_id=car.id).delete()
         Review.query.filter_by(car_id=car.id).delete()
+        stale = forget_similar(car.id)
         db.session.delete(car)
         db.session.commit()
+        queue_similar(stale=stale)
+        invalidate_catalog()
+        wishlist_cache.clear()
     return redirect(url_for('admin'))
 
 @app.route('/admin/enquiry/read/<int:enq_id>')
@@ -440,6 +2125,7 @@ def create_promo():
     amount = safe_int(request.form.get('amount'))
     db.session.add(PromoCode(code=code, discount_amount=amount))
     db.session.commit()
+    invalidate_catalog()
     flash(f"Promo Code {code} Created", "success")
     return redirect(url_for('admin'))
 
@@ -450,6 +2136,7 @@ def delete_promo(p_id):
     p = PromoCode.query.get(p_id)
     db.session.delete(p)
     db.session.commit()
+    invalidate_catalog()
     return redirect(url_for('admin'))
 
 @app.route('/admin/banner/add', methods=['POST'])
@@ -460,10 +2147,18 @@ def add_banner():
     title = request.form.get('title')
     subtitle = request.form.get('subtitle')
     
-    fname = save_image_to_db(file)
+    images = ImageBatch()
+    try:
+        fname = images.add(file)
+    except ImageTooLarge as e:
+        db.session.rollback()
+        flash(str(e), "danger")
+        return redirect(url_for('admin'))
     if fname:
         db.session.add(Banner(image=fname, title=title, subtitle=subtitle, is_active=True))
         db.session.commit()
+        queue_variants(images.new_names)
+        invalidate_catalog()
         flash("Banner Added", "success")
     else:
         flash("No file selected", "warning")
@@ -476,6 +2171,7 @@ def delete_banner(b_id):
     b = Banner.query.get(b_id)
     db.session.delete(b)
     db.session.commit()
+    invalidate_catalog()
     return redirect(url_for('admin'))
 
 @app.route('/admin/upload-site-images', methods=['GET', 'POST'])
@@ -484,10 +2180,14 @@ def upload_site_images():
     if not current_user.is_admin: return redirect(url_for('home'))
     if request.method == 'POST':
         files = request.files.getlist('files')
-        uploaded = []
-        for f in files:
-            name = save_image_to_db(f, preserve_name=True)
-            uploaded.append(name)
+        images = ImageBatch()
+        try:
+            uploaded = [name for name in (images.add(f, preserve_name=True) for f in files) if name]
+        except ImageTooLarge as e:
+            db.session.rollback()
+            return f"<h3>{e}</h3><a href='/admin/upload-site-images'>Back</a>", 413
+        db.session.commit()
+        queue_variants(images.new_names)
         return f"<h3>Uploaded: {', '.join(uploaded)}</h3><a href='/admin'>Back</a>"
     return """
     <html><body>
@@ -499,28 +2199,555 @@ def upload_site_images():
     </body></html>
     """
 
-# --- DB SETUP & FIX ---
-with app.app_context():
+# --- BULK IMPORT / EXPORT ---
+# Imports stream a CSV or JSONL file row by row, validate each row, and write
+# cars, pooled images and photo rows with bulk inserts, one transaction per
+# batch. Progress and per-row errors are kept on an ImportJob row so any
+# worker can answer the status poll.
+IMPORT_BATCH_SIZE = 500
+IMPORT_MAX_ERRORS = 1000
+IMPORT_STATUSES = ('Available', 'Sold', 'Pending')
+EXPORT_FIELDS = ['id', 'name', 'brand', 'category', 'price', 'year', 'fuel', 'transmission',
+                 'km_driven', 'description', 'status', 'images', 'created_at']
+import_folder = os.path.join(tempfile.gettempdir(), 'babacarbazar-imports')
+
+def iter_import_rows(path):
+    """Yield (line_number, dict) from a CSV or JSON-lines file without loading it whole."""
+    if path.lower().endswith('.csv'):
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            for line_no, row in enumerate(csv.DictReader(f), start=2):
+                yield line_no, row
+    else:
+        with open(path, encoding='utf-8') as f:
+            for line_no, line in enumerate(f, start=1):
+                if line.strip():
+                    try:
+                        row = json.loads(line)
+                    except ValueError:
+                        row = None
+                    yield line_no, row if isinstance(row, dict) else {'__invalid__': 'not a JSON object'}
+
+def validate_import_row(row):
+    """Return (car mapping, image names, error)."""
+    if '__invalid__' in row:
+        return None, None, row['__invalid__']
+    clean = {k: (str(v).strip() if v is not None else '') for k, v in row.items() if k}
+    for field in ('name', 'brand'):
+        if not clean.get(field):
+            return None, None, f"missing {field}"
+    numbers = {}
+    for field in ('price', 'year', 'km_driven'):
+        value = clean.get(field, '').replace(',', '')
+        if value and not value.isdigit():
+            return None, None, f"{field} must be a whole number"
+        numbers[field] = int(value) if value else 0
+    if numbers['year'] and not 1950 <= numbers['year'] <= datetime.utcnow().year + 1:
+        return None, None, "year out of range"
+    status = {s.lower(): s for s in IMPORT_STATUSES}.get(clean.get('status', '').lower() or 'available')
+    if status is None:
+        return None, None, f"status must be one of {', '.join(IMPORT_STATUSES)}"
+    images = row.get('images')
+    if isinstance(images, str):
+        images = [n.strip() for n in re.split(r'[;|]', images) if n.strip()]
+    images = [str(n) for n in images or []]
+    car = {
+        'name': clean['name'][:100], 'brand': clean['brand'][:50], 'category': clean.get('category', '')[:50],
+        'fuel': clean.get('fuel', '')[:20], 'transmission': clean.get('transmission', '')[:20],
+        'description': clean.get('description', ''), 'status': status,
+        'created_at': datetime.utcnow(), **numbers,
+    }
+    return car, images, None
+
+def read_import_image(zip_path, member):
+    """Runs on the worker pool: pull one image out of the zip and put it in blob storage."""
+    limit = app.config['MAX_IMAGE_BYTES']
+    with zipfile.ZipFile(zip_path) as zf, zf.open(member) as f:
+        # The size in the zip header is not trusted; read at most one byte past the cap.
+        data = f.read(limit + 1)
+    if len(data) > limit:
+        raise ImageTooLarge(f"{os.path.basename(member)} is larger than {limit // (1024 * 1024)} MB")
+    img = ImagePool(name=f"{uuid.uuid4().hex}{os.path.splitext(member)[1].lower()}",
+                    mimetype=mimetypes.guess_type(member)[0] or 'image/jpeg', uploaded_at=datetime.utcnow())
+    store_blob(img, data)
+    return {'name': img.name, 'mimetype': img.mimetype, 'etag': img.etag, 'size': img.size,
+            'storage': img.storage, 'data': img.data, 'uploaded_at': img.uploaded_at}
+
+def write_import_batch(batch, zip_path, zip_members):
+    """Insert one batch of validated rows in a single transaction. Returns the new car ids."""
+    wanted = {name for _, _, images in batch for name in images if name in zip_members}
+    stored = dict(zip(wanted, image_workers.map(lambda n: read_import_image(zip_path, zip_members[n]), wanted)))
+    # Content already in the pool (or repeated within the zip) reuses the existing name.
+    known = shared_image_name(img['etag'] for img in stored.values())
+    fresh = []
+    for img in stored.values():
+        if img['etag'] in known:
+            img['name'] = known[img['etag']]
+        else:
+            known[img['etag']] = img['name']
+            fresh.append(img)
+    if fresh:
+        db.session.bulk_insert_mappings(ImagePool, fresh)
+
+    cars = []
+    for _, car, images in batch:
+        names = [stored[n]['name'] if n in stored else n for n in images] or ['default.jpg']
+        car.update(images=json.dumps(names), cover_image=names[0])
+        cars.append(car)
+    db.session.bulk_insert_mappings(Car, cars, return_defaults=True)
+    db.session.bulk_insert_mappings(CarImage, [
+        {'car_id': car['id'], 'name': name, 'position': i}
+        for car in cars for i, name in enumerate(json.loads(car['images']))])
+    ids = [car['id'] for car in cars]
+    reindex_cars(db.session.connection(), ids)
+    db.session.commit()
+    # Imports already run off the request, so re-rank inline once the batch is committed.
+    run_similar_job(ids)
+    return ids, [img['name'] for img in fresh]
+
+def run_import(job_id, path, zip_path=None, progress=None):
+    """Import every row of path, recording progress on the ImportJob row."""
+    job = db.session.get(ImportJob, job_id)
+    job.status = 'running'
+    db.session.commit()
+    errors, batch, processed, inserted = [], [], 0, 0
+    zip_members = {}
+    def flush():
+        nonlocal inserted, batch
+        try:
+            ids, new_images = write_import_batch(batch, zip_path, zip_members)
+            inserted += len(ids)
+            queue_variants(new_images)
+        except Exception as e:
+            db.session.rollback()
+            errors.extend({'row': line_no, 'error': f"batch failed: {e}"} for line_no, _, _ in batch)
+        batch = []
+        job.processed, job.inserted = processed, inserted
+        job.errors = json.dumps(errors[:IMPORT_MAX_ERRORS])
+        db.session.commit()
+        if progress:
+            progress(processed, inserted, len(errors))
+
+    try:
+        if zip_path:
+            limit = app.config['MAX_IMAGE_BYTES']
+            try:
+                with zipfile.ZipFile(zip_path) as zf:
+                    infos = zf.infolist()
+            except zipfile.BadZipFile as e:
+                raise ValueError(f"images zip is unreadable: {e}") from e
+            for info in infos:
+                if info.is_dir():
+                    continue
+                if info.file_size > limit:
+                    errors.append({'row': None, 'error': f"{info.filename} is larger than {limit // (1024 * 1024)} MB"})
+                    continue
+                zip_members[os.path.basename(info.filename)] = info.filename
+        for line_no, row in iter_import_rows(path):
+            processed += 1
+            car, images, error = validate_import_row(row)
+            if error:
+                errors.append({'row': line_no, 'error': error})
+            else:
+                batch.append((line_no, car, images))
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                flush()
+        flush()
+        job.status = 'done'
+    except Exception as e:
+        db.session.rollback()
+        errors.append({'row': None, 'error': str(e)})
+        job.status = 'failed'
+    job.processed, job.inserted = processed, inserted
+    job.errors = json.dumps(errors[:IMPORT_MAX_ERRORS])
+    job.finished_at = datetime.utcnow()
+    db.session.commit()
+    invalidate_catalog()
+    return job
+
+def run_import_in_background(job_id, path, zip_path):
+    with app.app_context():
+        try:
+            run_import(job_id, path, zip_path)
+        finally:
+            shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+
+@app.route('/admin/import', methods=['GET', 'POST'])
+@login_required
+def import_inventory():
+    if not current_user.is_admin: return redirect(url_for('home'))
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        if not upload or not upload.filename.lower().endswith(('.csv', '.jsonl', '.ndjson')):
+            return jsonify({'error': 'Upload a .csv or .jsonl file'}), 400
+        os.makedirs(import_folder, exist_ok=True)
+        workdir = tempfile.mkdtemp(dir=import_folder)
+        path = os.path.join(workdir, secure_filename(upload.filename))
+        upload.save(path)
+        zip_path = None
+        images = request.files.get('images')
+        if images and images.filename:
+            zip_path = os.path.join(workdir, 'images.zip')
+            images.save(zip_path)
+            if not zipfile.is_zipfile(zip_path):
+                shutil.rmtree(workdir, ignore_errors=True)
+                return jsonify({'error': 'Images must be a .zip file'}), 400
+        job = ImportJob(id=uuid.uuid4().hex, filename=upload.filename)
+        db.session.add(job)
+        db.session.commit()
+        threading.Thread(target=run_import_in_background, args=(job.id, path, zip_path), daemon=True).start()
+        return jsonify({'job_id': job.id, 'status_url': url_for('import_status', job_id=job.id)}), 202
+    return """
+    <html><body>
+        <h2>Bulk Import Inventory</h2>
+        <p>CSV or JSON-lines with name, brand, category, price, year, fuel, transmission, km_driven,
+           description, status and images (file names in the zip, separated by ;).</p>
+        <form method="post" enctype="multipart/form-data">
+            <p>Listings: <input type="file" name="file" accept=".csv,.jsonl,.ndjson"></p>
+            <p>Images (zip, optional): <input type="file" name="images" accept=".zip"></p>
+            <input type="submit" value="Import">
+        </form>
+    </body></html>
+    """
+
+@app.route('/admin/import/<job_id>')
+@login_required
+def import_status(job_id):
+    if not current_user.is_admin: abort(403)
+    job = db.session.get(ImportJob, job_id) or abort(404)
+    return jsonify({'job_id': job.id, 'filename': job.filename, 'status': job.status, 'processed': job.processed,
+                    'inserted': job.inserted, 'errors': json.loads(job.errors or '[]'),
+                    'finished_at': job.finished_at.isoformat() if job.finished_at else None})
+
+def iter_export_rows(batch_size=1000):
+    """Yield export dicts for the whole catalog, one keyset batch in memory at a time."""
+    last_id = 0
+    while True:
+        cars = Car.query.filter(Car.id > last_id).order_by(Car.id).limit(batch_size).all()
+        if not cars:
+            break
+        last_id = cars[-1].id
+        photos = defaultdict(list)
+        for car_id, name in db.session.query(CarImage.car_id, CarImage.name) \
+                .filter(CarImage.car_id.in_([c.id for c in cars])).order_by(CarImage.car_id, CarImage.position):
+            photos[car_id].append(name)
+        for car in cars:
+            yield {'id': car.id, 'name': car.name, 'brand': car.brand, 'category': car.category, 'price': car.price,
+                   'year': car.year, 'fuel': car.fuel, 'transmission': car.transmission, 'km_driven': car.km_driven,
+                   'description': car.description, 'status': car.status,
+                   'images': ';'.join(photos.get(car.id) or [car.cover_image or 'default.jpg']),
+                   'created_at': car.created_at.isoformat() if car.created_at else ''}
+        db.session.expunge_all()
+
+@app.route('/admin/export.<fmt>')
+@login_required
+def export_inventory(fmt):
+    if not current_user.is_admin: return redirect(url_for('home'))
+    if fmt not in ('csv', 'jsonl'): abort(404)
+
+    def generate():
+        if fmt == 'jsonl':
+            for row in iter_export_rows():
+                yield json.dumps(row) + '\n'
+            return
+        buf = io.StringIO()
+        writer = csv.DictWriter(buf, fieldnames=EXPORT_FIELDS)
+        writer.writeheader()
+        for row in iter_export_rows():
+            writer.writerow(row)
+            if buf.tell() > 64 * 1024:
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+        yield buf.getvalue()
+
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(stream_with_context(generate()), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename=inventory-{datetime.utcnow():%Y%m%d}.{fmt}'})
+
+@app.cli.command('import-inventory')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--images', 'zip_path', type=click.Path(exists=True, dir_okay=False), help='Zip of images named in the rows.')
+def import_inventory_command(path, zip_path):
+    """Bulk-import cars from a CSV or JSON-lines file."""
+    if not path.lower().endswith(('.csv', '.jsonl', '.ndjson')):
+        raise click.BadParameter('expected a .csv or .jsonl file', param_hint='PATH')
+    if zip_path and not zipfile.is_zipfile(zip_path):
+        raise click.BadParameter('not a zip file', param_hint='--images')
+    job = ImportJob(id=uuid.uuid4().hex, filename=os.path.basename(path))
+    db.session.add(job)
+    db.session.commit()
+    job = run_import(job.id, path, zip_path,
+                     progress=lambda done, ok, bad: click.echo(f"{done} rows read, {ok} inserted, {bad} errors"))
+    for error in json.loads(job.errors)[:20]:
+        click.echo(f"  row {error['row']}: {error['error']}")
+    click.echo(f"Import {job.status}: {job.inserted} of {job.processed} rows inserted.")
+
+# --- DB SETUP & MIGRATIONS ---
+# Every migration must be safe to re-run: a fresh database gets its tables from
+# create_all() and then replays the whole list.
+MIGRATIONS = []
+
+def migration(func):
+    MIGRATIONS.append(func)
+    return func
+
+@migration
+def sync_schema():
+    """Add columns declared on the models but missing from existing tables."""
+    inspector = db.inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {col['name'] for col in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            col_type = column.type.compile(dialect=db.engine.dialect)
+            with db.engine.begin() as conn:
+                conn.execute(db.text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {col_type}'))
+            print(f"Added column {table.name}.{column.name}")
+
+@migration
+def widen_banner_image():
+    """Banner.image used to be a short VARCHAR; /fix-db dropped the table to widen it."""
+    if db.engine.dialect.name == 'postgresql':
+        with db.engine.begin() as conn:
+            conn.execute(db.text('ALTER TABLE banner ALTER COLUMN image TYPE TEXT'))
+
+def dedupe_wishlist():
+    """Drop duplicate (user_id, car_id) rows left by double clicks, keeping the oldest."""
+    if not db.inspect(db.engine).has_table('wishlist'):
+        return
+    with db.engine.begin() as conn:
+        conn.execute(db.text('DELETE FROM wishlist WHERE id NOT IN '
+                             '(SELECT keep FROM (SELECT MIN(id) AS keep FROM wishlist GROUP BY user_id, car_id) AS kept)'))
+
+@migration
+def create_indexes():
+    """Create indexes declared in __table_args__ that existing tables are missing."""
+    dedupe_wishlist()  # ix_wishlist_user_car is unique
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+
+@migration
+def create_search_index():
+    """Build the full-text index behind /api/search."""
+    global _fts_available
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(db.text(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS car_search USING fts5("
+                    "name, brand, category, fuel, description, tokenize='unicode61', prefix='2 3')"))
+                conn.execute(db.text("DELETE FROM car_search"))
+                conn.execute(db.text(
+                    "INSERT INTO car_search (rowid, name, brand, category, fuel, description) "
+                    "SELECT id, name, brand, category, fuel, description FROM car"))
+        except Exception as e:
+            print(f"FTS5 unavailable, search falls back to LIKE: {e}")
+        _fts_available = None
+    elif dialect == 'postgresql':
+        with db.engine.begin() as conn:
+            conn.execute(db.text(
+                f"CREATE INDEX IF NOT EXISTS ix_car_search_tsv ON car "
+                f"USING gin (to_tsvector('simple', {SEARCH_DOCUMENT_SQL}))"))
+
+@migration
+def split_car_images():
+    """Move the JSON Car.images strings into CarImage rows and fill Car.cover_image."""
+    sync_schema()
+    last_id = 0
+    while True:
+        batch = db.session.query(Car.id, Car.images).filter(Car.id > last_id, Car.cover_image.is_(None)) \
+            .order_by(Car.id).limit(500).all()
+        if not batch:
+            break
+        last_id = batch[-1].id
+        photos, covers = [], []
+        for car_id, images in batch:
+            try: names = json.loads(images)
+            except: names = []
+            if not isinstance(names, list): names = [names]
+            names = [n for n in names if n] or ['default.jpg']
+            photos.extend({'car_id': car_id, 'name': name, 'position': i} for i, name in enumerate(names))
+            covers.append({'id': car_id, 'cover_image': names[0]})
+        db.session.execute(db.delete(CarImage).where(CarImage.car_id.in_([c['id'] for c in covers])))
+        db.session.execute(db.insert(CarImage), photos)
+        db.session.execute(db.update(Car), covers)
+        db.session.commit()
+
+@migration
+def add_image_storage():
+    """ImagePool.storage records whether a row's bytes are in the database or the blob store."""
+    sync_schema()
+
+@migration
+def index_image_hashes():
+    """ix_image_pool_etag backs content deduplication on upload."""
+    create_indexes()
+
+@migration
+def build_similar_index():
+    """Rank neighbours for the cars that existed before SimilarCar did. Always a full
+    rebuild: an interrupted run leaves a partial index that a row check would accept."""
+    rebuild_similar()
+
+@migration
+def unique_wishlist():
+    """Replace the plain ix_wishlist_user_car with the unique one."""
+    with db.engine.begin() as conn:
+        conn.execute(db.text('DROP INDEX IF EXISTS ix_wishlist_user_car'))
+    create_indexes()
+
+def schema_version():
+    row = SchemaVersion.query.first()
+    return row.version if row else 0
+
+def upgrade_db():
+    """Create missing tables and apply pending migrations in order. Returns the names applied."""
     db.create_all()
-    if not User.query.filter_by(email='babaadmin@gmail.com').first():
-        admin_pass = generate_password_hash('@namanadmin', method='pbkdf2:sha256')
-        db.session.add(User(name='BABA-CAR_BAZAR', email='babaadmin@gmail.com', password=admin_pass, is_admin=True))
+    row = SchemaVersion.query.first()
+    if row is None:
+        row = SchemaVersion(version=0)
+        db.session.add(row)
+    applied = []
+    for func in MIGRATIONS[row.version:]:
+        func()
+        row.version += 1
         db.session.commit()
-        print("Admin Account Created.")
+        applied.append(func.__name__)
+        print(f"Applied migration {row.version}: {func.__name__}")
+    db.session.commit()
+    return applied
+
+@app.cli.command('db-upgrade')
+def db_upgrade_command():
+    """Apply pending schema migrations without dropping any data."""
+    applied = upgrade_db()
+    click.echo(f"Schema at version {schema_version()} ({len(applied)} applied).")
+
+@app.cli.command('db-status')
+def db_status_command():
+    """Show the current schema version and pending migrations."""
+    current = schema_version()
+    click.echo(f"Schema at version {current} of {len(MIGRATIONS)}.")
+    for func in MIGRATIONS[current:]:
+        click.echo(f"  pending: {func.__name__}")
+
+# --- BOOTSTRAP ---
+# Importing the app does no database I/O. `flask init-db` migrates and seeds the
+# admin once per deployment; with BOOTSTRAP_ON_REQUEST on, each process's first
+# request checks the schema version and, if init-db was skipped, migrates under a
+# lock so workers booting together don't race on table creation.
+MIGRATION_LOCK_KEY = 0x6263620  # pg_advisory_lock key
+startup_timings = {}
+_bootstrap = {'done': False, 'lock': threading.Lock()}
+
+@contextmanager
+def migration_lock():
+    """Serialise migrations across processes: an advisory lock on PostgreSQL, a lock file otherwise."""
+    if db.engine.dialect.name == 'postgresql':
+        with db.engine.connect() as conn:
+            conn.execute(db.text('SELECT pg_advisory_lock(:key)'), {'key': MIGRATION_LOCK_KEY})
+            try:
+                yield
+            finally:
+                conn.execute(db.text('SELECT pg_advisory_unlock(:key)'), {'key': MIGRATION_LOCK_KEY})
+    elif fcntl is not None:
+        os.makedirs(app.instance_path, exist_ok=True)
+        with open(os.path.join(app.instance_path, 'migrate.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    else:
+        yield
+
+def seed_admin(email, password, name='BABA-CAR_BAZAR'):
+    """Create an admin account unless the email is taken. Returns True if one was created."""
+    if User.query.filter_by(email=email).first():
+        return False
+    db.session.add(User(name=name, email=email, password=generate_password_hash(password, method='pbkdf2:sha256'),
+                        is_admin=True))
+    db.session.commit()
+    return True
+
+def schema_is_current():
+    if not db.inspect(db.engine).has_table(SchemaVersion.__tablename__):
+        return False
+    return schema_version() >= len(MIGRATIONS)
+
+def bootstrap_db():
+    """Migrate and, on a database with no admin yet, seed the default one. Returns the migrations applied."""
+    with migration_lock():
+        applied = upgrade_db()
+        if not User.query.filter_by(is_admin=True).first():
+            seed_admin(app.config['ADMIN_EMAIL'], app.config['ADMIN_PASSWORD'])
+    return applied
+
+@app.before_request
+def lazy_bootstrap():
+    if _bootstrap['done'] or not app.config['BOOTSTRAP_ON_REQUEST']:
+        return
+    with _bootstrap['lock']:
+        if _bootstrap['done']:
+            return
+        started = time.perf_counter()
+        if not schema_is_current():
+            bootstrap_db()
+        startup_timings['bootstrap_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        _bootstrap['done'] = True
+        app.logger.info("Process %s ready: import %.0f ms, bootstrap %.0f ms", os.getpid(),
+                        startup_timings.get('import_ms', 0), startup_timings['bootstrap_ms'])
+
+@app.cli.command('init-db')
+@click.option('--no-admin', is_flag=True, help='Skip seeding the admin account.')
+def init_db_command(no_admin):
+    """Create tables, apply migrations and seed the admin account. Run once per deployment."""
+    with migration_lock():
+        applied = upgrade_db()
+        created = not no_admin and seed_admin(app.config['ADMIN_EMAIL'], app.config['ADMIN_PASSWORD'])
+    click.echo(f"Schema at version {schema_version()} ({len(applied)} applied)."
+               + (f" Admin {app.config['ADMIN_EMAIL']} created." if created else ""))
+
+@app.cli.command('seed-admin')
+@click.option('--email', default=lambda: app.config['ADMIN_EMAIL'], show_default='ADMIN_EMAIL')
+@click.option('--password', default=lambda: app.config['ADMIN_PASSWORD'], show_default='ADMIN_PASSWORD')
+@click.option('--name', default='BABA-CAR_BAZAR', show_default=True)
+def seed_admin_command(email, password, name):
+    """Create an admin account if the email is not registered yet."""
+    if seed_admin(email, password, name):
+        click.echo(f"Admin {email} created.")
+    else:
+        click.echo(f"{email} already exists.")
+
+@app.cli.command('startup-report')
+def startup_report_command():
+    """Show what starting a worker costs: module import, schema check and pending migrations."""
+    started = time.perf_counter()
+    current = schema_is_current()
+    check_ms = round((time.perf_counter() - started) * 1000, 1)
+    version = schema_version() if db.inspect(db.engine).has_table(SchemaVersion.__tablename__) else 0
+    click.echo(json.dumps({'import_ms': startup_timings.get('import_ms'), 'schema_check_ms': check_ms,
+                           'schema_version': version, 'schema_current': current,
+                           'pending_migrations': [f.__name__ for f in MIGRATIONS[version:]],
+                           'bootstrap_on_request': app.config['BOOTSTRAP_ON_REQUEST']}, indent=2))
 
 @app.route('/fix-db')
+@login_required
 def fix_db():
+    if not current_user.is_admin: return redirect(url_for('home'))
     try:
-        # Also drop Banner to ensure it ensures it matches
-        try: Banner.__table__.drop(db.engine)
-        except: pass
-        
-        db.create_all()
-        return "SUCCESS: Database Fixed! Banner table recreated with larger limit."
+        applied = upgrade_db()
+        return f"SUCCESS: Schema at version {schema_version()}. Applied: {', '.join(applied) or 'nothing'}"
     except Exception as e:
-        # If table didn't exist or other error, try creating anyway
-        db.create_all()
-        return f"Fix attempted. Result: {str(e)}"
+        db.session.rollback()
+        return f"Migration failed. Result: {str(e)}", 500
+
+startup_timings['import_ms'] = round((time.perf_counter() - IMPORT_STARTED) * 1000, 1)
 
 if __name__ == '__main__':
     port = int(os.environ.get("PORT", 5000))
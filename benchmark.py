@@ -0,0 +1,365 @@
+"""Load-test benchmark for BABA CAR BAZAR.
+
+Seeds a throwaway database with a synthetic catalog, drives the public and
+admin routes, and prints (or writes) a JSON report that can be diffed
+between commits:
+
+    python benchmark.py --cars 10000 --output bench.json
+    python benchmark.py --mode gunicorn --workers 4 --concurrency 16
+    python benchmark.py --database-url postgresql://localhost/bench_tmp
+    python benchmark.py --mode gunicorn --db-profile default   # untuned engine, for comparison
+
+Latency percentiles are per route, query counts come from the Server-Timing
+header the app emits, and peak RSS covers the benchmark process (client mode)
+or the gunicorn workers (gunicorn mode).
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import shutil
+import socket
+import argparse
+import contextlib
+import platform
+import resource
+import tempfile
+import subprocess
+import urllib.request
+import urllib.parse
+import http.cookiejar
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+BRANDS = {
+    'Maruti': ['Swift', 'Baleno', 'Dzire', 'Brezza', 'Ertiga'],
+    'Hyundai': ['Creta', 'Venue', 'i20', 'Verna', 'Alcazar'],
+    'Tata': ['Nexon', 'Harrier', 'Punch', 'Altroz', 'Safari'],
+    'Mahindra': ['XUV700', 'Thar', 'Scorpio', 'Bolero', 'XUV300'],
+    'Honda': ['City', 'Amaze', 'Elevate', 'Jazz', 'WR-V'],
+    'Toyota': ['Innova', 'Fortuner', 'Glanza', 'Hyryder', 'Camry'],
+}
+CATEGORIES = ['SUV', 'Sedan', 'Hatchback', 'MUV']
+FUELS = ['Petrol', 'Diesel', 'CNG']
+TRANSMISSIONS = ['Manual', 'Automatic']
+STATUSES = ['Available'] * 8 + ['Sold', 'Reserved']
+BENCH_ADMIN = ('bench-admin@example.com', 'bench-admin')
+QUERY_COUNT_RE = re.compile(r'desc="(\d+) queries"')
+
+
+# --- SEEDING ---
+def seed(app_module, args, rng):
+    """Fill every table with synthetic rows using batched core inserts."""
+    from werkzeug.security import generate_password_hash
+    m = app_module
+    db = m.db
+    batch = 1000
+    now = datetime.utcnow()
+
+    with m.app.app_context():
+        with contextlib.redirect_stdout(sys.stderr):  # keep stdout for the JSON report
+            m.upgrade_db()
+        users = [{'name': f'User {i}', 'email': f'user{i}@example.com',
+                  'password': generate_password_hash('bench', method='pbkdf2:sha256:1000'), 'is_admin': False}
+                 for i in range(args.users)]
+        users.append({'name': 'Bench Admin', 'email': BENCH_ADMIN[0],
+                      'password': generate_password_hash(BENCH_ADMIN[1], method='pbkdf2:sha256:1000'), 'is_admin': True})
+        db.session.execute(db.insert(m.User), users)
+        user_ids = [u.id for u in m.User.query.with_entities(m.User.id)]
+
+        image_names = []
+        for i in range(args.images):
+            size = int(rng.gauss(args.image_kb, args.image_kb / 4)) * 1024
+            img = m.ImagePool(name=f'{os.urandom(16).hex()}.jpg', mimetype='image/jpeg')
+            m.store_blob(img, os.urandom(max(size, 1024)))
+            db.session.add(img)
+            image_names.append(img.name)
+            if i % 50 == 49:
+                db.session.commit()
+        db.session.commit()
+
+        car_rows, photo_rows = [], []
+        for i in range(1, args.cars + 1):
+            brand = rng.choice(list(BRANDS))
+            photos = rng.sample(image_names, min(len(image_names), rng.randint(1, 5))) or ['default.jpg']
+            car_rows.append({
+                'id': i, 'name': f'{brand} {rng.choice(BRANDS[brand])}', 'brand': brand,
+                'category': rng.choice(CATEGORIES), 'price': rng.randrange(150000, 4000000, 5000),
+                'year': rng.randint(2008, 2025), 'fuel': rng.choice(FUELS), 'transmission': rng.choice(TRANSMISSIONS),
+                'km_driven': rng.randint(1000, 180000), 'description': f'Well maintained {brand}, single owner.',
+                'images': json.dumps(photos), 'cover_image': photos[0], 'status': rng.choice(STATUSES),
+                'created_at': now - timedelta(minutes=rng.randint(0, 60 * 24 * 365)),
+            })
+            photo_rows.extend({'car_id': i, 'name': name, 'position': p} for p, name in enumerate(photos))
+            if len(car_rows) >= batch:
+                db.session.execute(db.insert(m.Car), car_rows)
+                car_rows = []
+        if car_rows:
+            db.session.execute(db.insert(m.Car), car_rows)
+        for start in range(0, len(photo_rows), batch):
+            db.session.execute(db.insert(m.CarImage), photo_rows[start:start + batch])
+
+        def bulk(model, count, make):
+            rows = []
+            for _ in range(count):
+                rows.append(make())
+                if len(rows) >= batch:
+                    db.session.execute(db.insert(model), rows)
+                    rows = []
+            if rows:
+                db.session.execute(db.insert(model), rows)
+
+        bulk(m.Review, args.cars * args.reviews_per_car, lambda: {
+            'user_id': rng.choice(user_ids), 'car_id': rng.randint(1, args.cars), 'rating': rng.randint(1, 5),
+            'comment': 'Good car', 'created_at': now - timedelta(minutes=rng.randint(0, 60 * 24 * 365))})
+        wished = {(rng.choice(user_ids), rng.randint(1, args.cars)) for _ in range(args.users * 5)}
+        bulk(m.Wishlist, len(wished), lambda it=iter(wished): dict(zip(('user_id', 'car_id'), next(it))))
+        bulk(m.Enquiry, args.cars // 2, lambda: {
+            'name': 'Buyer', 'phone': '9999999999', 'message': 'Is this still available?',
+            'car_id': rng.randint(1, args.cars), 'is_read': rng.random() < 0.7,
+            'date': now - timedelta(minutes=rng.randint(0, 60 * 24 * 90))})
+        db.session.commit()
+
+        # Core inserts bypass the mapper events and routes that keep the search and similarity indexes in sync.
+        m.create_search_index()
+        m.rebuild_similar()
+        if db.engine.dialect.name == 'sqlite':
+            with db.engine.begin() as conn:
+                conn.execute(db.text('ANALYZE'))
+        return image_names
+
+
+# --- SCENARIOS ---
+def scenarios(args, rng, image_names):
+    brands = list(BRANDS)
+
+    def inventory():
+        params = {}
+        if rng.random() < 0.5: params['brand'] = rng.choice(brands)
+        if rng.random() < 0.3: params['fuel'] = rng.choice(FUELS)
+        if rng.random() < 0.3: params['max_price'] = rng.randrange(300000, 4000000, 100000)
+        return '/inventory' + ('?' + urllib.parse.urlencode(params) if params else '')
+
+    def search():
+        word = rng.choice(brands + [model for models in BRANDS.values() for model in models])
+        return '/api/search?' + urllib.parse.urlencode({'q': word[:rng.randint(2, len(word))]})
+
+    return {
+        'home': (lambda: '/', False),
+        'inventory': (inventory, False),
+        'car_detail': (lambda: f'/car/{rng.randint(1, args.cars)}', False),
+        'api_search': (search, False),
+        'image': (lambda: f'/static/uploads/{rng.choice(image_names)}', False),
+        'admin': (lambda: '/admin', True),
+        'admin_enquiries': (lambda: '/admin/api/enquiries', True),
+        'enquire': (lambda: ('/enquire', {'name': 'Buyer', 'phone': '9999999999', 'message': 'Still available?',
+                                          'car_id': rng.randint(1, args.cars)}), False),
+    }
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def summarize(samples, elapsed):
+    latencies = [s[0] for s in samples]
+    queries = [s[1] for s in samples if s[1] is not None]
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for s in samples if s[2] >= 400),
+        'rps': round(len(samples) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'mean_queries': round(sum(queries) / len(queries), 1) if queries else None,
+        'max_queries': max(queries) if queries else None,
+    }
+
+
+def query_count(server_timing):
+    match = QUERY_COUNT_RE.search(server_timing or '')
+    return int(match.group(1)) if match else None
+
+
+# --- DRIVERS ---
+def run_client(app_module, args, plan):
+    """Drive the Flask test client in-process, one request at a time."""
+    anon = app_module.app.test_client()
+    admin = app_module.app.test_client()
+    admin.post('/login', data={'email': BENCH_ADMIN[0], 'password': BENCH_ADMIN[1]})
+    results = {}
+    def send(client, target):
+        # Scenarios return a path to GET or a (path, form) pair to POST.
+        return client.post(target[0], data=target[1]) if isinstance(target, tuple) else client.get(target)
+
+    for name, (make_path, needs_admin) in plan.items():
+        client = admin if needs_admin else anon
+        for _ in range(args.warmup):
+            send(client, make_path())
+        samples = []
+        started = time.perf_counter()
+        for _ in range(args.requests):
+            path = make_path()
+            t0 = time.perf_counter()
+            response = send(client, path)
+            response.get_data()
+            samples.append((time.perf_counter() - t0, query_count(response.headers.get('Server-Timing')),
+                            response.status_code))
+        results[name] = summarize(samples, time.perf_counter() - started)
+    return results
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def run_gunicorn(args, plan, env):
+    """Start a local gunicorn and drive it over HTTP with a thread pool.
+    Returns the per-route results and how long gunicorn took to answer its first request."""
+    port = free_port()
+    base = f'http://127.0.0.1:{port}'
+    here = os.path.dirname(os.path.abspath(__file__))
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-w', str(args.workers), '-b', f'127.0.0.1:{port}',
+         '--log-level', 'warning', 'app:app'], cwd=here, env=env)
+    booted = time.perf_counter()
+    try:
+        deadline = time.time() + 60
+        while True:
+            try:
+                urllib.request.urlopen(base + '/metrics', timeout=1).read()
+                ready_ms = round((time.perf_counter() - booted) * 1000, 1)
+                break
+            except OSError:
+                if time.time() > deadline or server.poll() is not None:
+                    raise RuntimeError('gunicorn did not start')
+                time.sleep(0.2)
+
+        jar = http.cookiejar.CookieJar()
+        admin_opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar))
+        admin_opener.open(base + '/login', urllib.parse.urlencode(
+            {'email': BENCH_ADMIN[0], 'password': BENCH_ADMIN[1]}).encode()).read()
+        anon_opener = urllib.request.build_opener()
+
+        def fetch(opener, target):
+            path, form = target if isinstance(target, tuple) else (target, None)
+            data = urllib.parse.urlencode(form).encode() if form else None
+            t0 = time.perf_counter()
+            try:
+                with opener.open(base + path, data, timeout=30) as response:
+                    response.read()
+                    status, timing = response.status, response.headers.get('Server-Timing')
+            except urllib.error.HTTPError as e:
+                status, timing = e.code, e.headers.get('Server-Timing')
+            return time.perf_counter() - t0, query_count(timing), status
+
+        results = {}
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            for name, (make_path, needs_admin) in plan.items():
+                opener = admin_opener if needs_admin else anon_opener
+                list(pool.map(lambda p: fetch(opener, p), [make_path() for _ in range(args.warmup)]))
+                paths = [make_path() for _ in range(args.requests)]
+                started = time.perf_counter()
+                samples = list(pool.map(lambda p: fetch(opener, p), paths))
+                results[name] = summarize(samples, time.perf_counter() - started)
+        return results, ready_ms
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def peak_rss_mb(who):
+    rss = resource.getrusage(who).ru_maxrss
+    return round(rss / (1024 * 1024) if platform.system() == 'Darwin' else rss / 1024, 1)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cars', type=int, default=1000)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--reviews-per-car', type=int, default=3)
+    parser.add_argument('--images', type=int, default=200, help='distinct images in the pool')
+    parser.add_argument('--image-kb', type=int, default=250, help='mean image size in KB')
+    parser.add_argument('--requests', type=int, default=200, help='measured requests per route')
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--mode', choices=['client', 'gunicorn'], default='client')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers')
+    parser.add_argument('--concurrency', type=int, default=8, help='parallel HTTP clients (gunicorn mode)')
+    parser.add_argument('--database-url', help='empty database to use instead of a temporary SQLite file')
+    parser.add_argument('--replica-url', help='read replica for the public routes (DATABASE_REPLICA_URL)')
+    parser.add_argument('--db-profile', choices=['tuned', 'default'], default='tuned',
+                        help="engine settings to run with (DB_PROFILE)")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='write the JSON report here as well as stdout')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix='bcb-bench-')
+    env = dict(os.environ,
+               DATABASE_URL=args.database_url or f'sqlite:///{os.path.join(workdir, "bench.db")}',
+               IMAGE_CACHE_FOLDER=os.path.join(workdir, 'cache'),
+               BLOB_FOLDER=os.path.join(workdir, 'blobs'),
+               WRITE_QUEUE_PATH=os.path.join(workdir, 'write_queue.db'),
+               DB_PROFILE=args.db_profile)
+    if args.replica_url:
+        env['DATABASE_REPLICA_URL'] = args.replica_url
+    os.environ.update(env)
+    try:
+        started = time.perf_counter()
+        import app as app_module
+        image_names = seed(app_module, args, rng)
+        seed_seconds = time.perf_counter() - started
+
+        plan = scenarios(args, rng, image_names)
+        if args.mode == 'client':
+            results, ready_ms = run_client(app_module, args, plan), None
+            rss = peak_rss_mb(resource.RUSAGE_SELF)
+        else:
+            results, ready_ms = run_gunicorn(args, plan, env)
+            rss = peak_rss_mb(resource.RUSAGE_CHILDREN)
+
+        report = {
+            'meta': {
+                'commit': git_commit(), 'timestamp': datetime.utcnow().isoformat() + 'Z',
+                'python': platform.python_version(), 'database': env['DATABASE_URL'].split(':', 1)[0],
+                'db_profile': args.db_profile, 'replica': bool(args.replica_url),
+                'mode': args.mode, 'workers': args.workers if args.mode == 'gunicorn' else 1,
+                'concurrency': args.concurrency if args.mode == 'gunicorn' else 1,
+                'cars': args.cars, 'images': args.images, 'image_kb': args.image_kb,
+                'requests_per_route': args.requests, 'seed': args.seed,
+            },
+            'seed_seconds': round(seed_seconds, 2),
+            'startup': {'import_ms': app_module.startup_timings.get('import_ms'), 'gunicorn_ready_ms': ready_ms},
+            'peak_rss_mb': rss,
+            'routes': results,
+        }
+        output = json.dumps(report, indent=2)
+        print(output)
+        if args.output:
+            with open(args.output, 'w') as f:
+                f.write(output + '\n')
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()